@@ -1,9 +1,19 @@
 import streamlit as st
 import pandas as pd
-import gspread
-from gspread_dataframe import set_with_dataframe, get_as_dataframe
-from google.oauth2.service_account import Credentials
-import math
+from bank_core import (
+    ALL_ITEMS, DEFAULT_BANK_BUY_PCT, ORIGINAL_ITEM_CATEGORIES, QUANTITY_MAX, UserHoldings, item_summary,
+    parse_deposit_import, parse_targets, stack_value_tenths, target_changes, user_breakdown,
+)
+from bank_history import HistoryRecorder, render_category_chart
+from bank_quota import PROCESS_METRICS, start_run_metrics, track_helper
+from bank_storage import (
+    ADMIN_LOGS_TAB, PENDING_DUPES_TAB, SHEET_TAB, TARGETS_TAB,
+    ConcurrentDepositError, open_storage,
+)
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 # --- HEADLINE & PAGE CONFIG ---
 st.set_page_config(page_title="PoE Bulk Item Banking App", layout="wide")
@@ -11,28 +21,6 @@ st.title("PoE Bulk Item Banking App")
 st.caption("Bulk community banking for PoE item pooling and tracking")
 
 # ---- CONFIGURATION ----
-ORIGINAL_ITEM_CATEGORIES = {
-    "Waystones": [
-        "Waystone EXP + Delirious",
-        "Waystone EXP 35%",
-        "Waystone EXP"
-    ],
-    "White Item Bases": [
-        "Stellar Amulet",
-        "Breach ring level 82",
-        "Heavy Belt"
-    ],
-    "Tablets": [
-        "Tablet Exp 9%+10% (random)",
-        "Quantity Tablet (6%+)",
-        "Grand Project Tablet"
-    ],
-    "Various": [
-        "Logbook level 79-80"
-    ]
-}
-ALL_ITEMS = sum(ORIGINAL_ITEM_CATEGORIES.values(), [])
-
 CATEGORY_COLORS = {
     "Waystones": "#FFD700",   # Gold/Yellow
     "White Item Bases": "#FFFFFF",      # White
@@ -55,152 +43,135 @@ ITEM_COLORS = {
 def get_item_color(item):
     return ITEM_COLORS.get(item, "#FFF")
 
-SHEET_NAME = "poe_item_bank"
-SHEET_TAB = "Sheet1"
-TARGETS_TAB = "Targets"
-ADMIN_LOGS_TAB = "AdminLogs"
-PENDING_DUPES_TAB = "PendingDupes"
-
-DEFAULT_BANK_BUY_PCT = 80   # percent
-
-# ---- GOOGLE SHEETS FUNCTIONS ----
-def get_gsheet_client():
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
-    creds_dict = st.secrets["gcp_service_account"]
-    credentials = Credentials.from_service_account_info(creds_dict, scopes=scopes)
-    client = gspread.authorize(credentials)
-    return client
-
-def load_data():
-    gc = get_gsheet_client()
-    sheet = gc.open(SHEET_NAME).worksheet(SHEET_TAB)
-    df = get_as_dataframe(sheet, evaluate_formulas=True, dtype=str)
-    df = df.dropna(how='all')
-    if not df.empty:
-        df = df.fillna("")
-        expected_cols = ["User", "Item", "Quantity"]
-        for col in expected_cols:
-            if col not in df.columns:
-                df[col] = ""
-        df = df[expected_cols]
-    else:
-        df = pd.DataFrame(columns=["User", "Item", "Quantity"])
-    df["Quantity"] = pd.to_numeric(df["Quantity"], errors="coerce").fillna(0).astype(int)
-    return df
+# Rows per page of a per-user breakdown table.
+BREAKDOWN_PAGE_SIZE = 50
+PAYOUT_COLUMN_CONFIG = {
+    "Fee (10%)": st.column_config.NumberColumn(format="%.1f"),
+    "Payout (Divines, after fee)": st.column_config.NumberColumn(format="%.1f"),
+}
 
-def save_data(df):
-    gc = get_gsheet_client()
-    sheet = gc.open(SHEET_NAME).worksheet(SHEET_TAB)
-    set_with_dataframe(sheet, df[["User", "Item", "Quantity"]], include_index=False)
+# Most matching users the depositor search offers to pick from.
+USER_SEARCH_LIMIT = 50
+HOLDINGS_COLUMN_CONFIG = {
+    "Value (Divines)": st.column_config.NumberColumn(format="%.1f"),
+    **PAYOUT_COLUMN_CONFIG,
+}
 
-def load_targets():
-    gc = get_gsheet_client()
-    sh = gc.open(SHEET_NAME)
+# Deposits per page of the bulk delete grid.
+DELETE_PAGE_SIZE = 100
+
+# How often a buffered batch of admin log entries is retried before it waits for the next rerun.
+ADMIN_LOG_FLUSH_ATTEMPTS = 3
+
+# ---- STORAGE FUNCTIONS ----
+@st.cache_resource(show_spinner=False)
+def get_storage():
+    # One backend per process (see bank_storage.open_storage), shared by every session.
+    return open_storage(st.secrets["gcp_service_account"])
+
+@track_helper
+def load_ledger(fresh=False):
+    """Current LedgerSnapshot; its frame is shared between sessions, so don't modify it in place."""
+    return get_storage().load_ledger(fresh=fresh)
+
+def load_data(fresh=False):
+    return load_ledger(fresh=fresh).frame
+
+@track_helper
+def prefetch(tabs):
+    # With the Sheets backend, fetch all of these tabs in one batched request.
+    get_storage().prefetch(tabs)
+
+@st.cache_resource(show_spinner=False)
+def get_history():
+    # One recorder per process: the history is read once and then kept in memory.
+    return HistoryRecorder(get_storage())
+
+@track_helper
+def record_progress(summary):
+    # Takes a snapshot only when the last one is HISTORY_SNAPSHOT_SECONDS old; otherwise a no-op.
+    values = stack_value_tenths(summary["Total"], summary["Target"], summary["Divines"])
     try:
-        ws = sh.worksheet(TARGETS_TAB)
-    except gspread.exceptions.WorksheetNotFound:
-        ws = sh.add_worksheet(title=TARGETS_TAB, rows=50, cols=3)
-        ws.append_row(["Item", "Target", "Divines"])
-    df = get_as_dataframe(ws, evaluate_formulas=True, dtype=str).dropna(how='all')
-
-    targets = {}
-    divines = {}
-    bank_buy_pct = DEFAULT_BANK_BUY_PCT
-
-    if not df.empty and "Item" in df.columns:
-        settings_row = df[df["Item"] == "_SETTINGS"]
-        if not settings_row.empty:
-            try:
-                bank_buy_pct = int(float(settings_row.iloc[0]["Target"]))
-            except Exception:
-                bank_buy_pct = DEFAULT_BANK_BUY_PCT
-        df = df[df["Item"] != "_SETTINGS"]
-        if "Target" not in df.columns:
-            df["Target"] = 100
-        if "Divines" not in df.columns:
-            df["Divines"] = ""
-        for idx, row in df.iterrows():
-            item = row["Item"]
-            try:
-                targets[item] = int(float(row["Target"]))
-            except Exception:
-                targets[item] = 100
-            try:
-                divines[item] = float(row["Divines"]) if str(row["Divines"]).strip() != "" else 0
-            except Exception:
-                divines[item] = 0
-    for item in ALL_ITEMS:
-        if item not in targets:
-            targets[item] = 100
-        if item not in divines:
-            divines[item] = 0
-    return targets, divines, bank_buy_pct, ws
-
-def save_targets(targets, divines, bank_buy_pct, ws):  # links removed
-    data_rows = [{"Item": item, "Target": targets[item], "Divines": divines[item]} for item in ALL_ITEMS]
-    data_rows.append({"Item": "_SETTINGS", "Target": bank_buy_pct, "Divines": ""})
-    df = pd.DataFrame(data_rows)
-    ws.clear()
-    set_with_dataframe(ws, df, include_index=False)
+        get_history().maybe_snapshot(summary["Total"], pd.Series(values, index=summary.index))
+    except Exception:
+        # History is a side show: the page still renders, and the next run retries the snapshot.
+        logger.exception("Recording the progress history failed")
+
+@track_helper
+def commit_deposits(rows):
+    return get_storage().commit_deposits(rows)
+
+@track_helper
+def confirm_deposits(rows):
+    return get_storage().confirm_deposits(rows)
+
+@track_helper
+def delete_deposits(deposit_ids):
+    return get_storage().delete_deposits(deposit_ids)
+
+@track_helper
+def load_targets():
+    return parse_targets(get_storage().load_targets_frame())
+
+@track_helper
+def save_targets(targets, divines, bank_buy_pct):  # links removed
+    # Only the cells that differ from what was last loaded are written.
+    get_storage().update_targets(target_changes(load_targets(), (targets, divines, bank_buy_pct)))
 
 # ---- ADMIN LOGGING FUNCTIONS ----
 def append_admin_log(action, details="", admin_user=""):
-    gc = get_gsheet_client()
-    try:
-        ws = gc.open(SHEET_NAME).worksheet(ADMIN_LOGS_TAB)
-    except gspread.exceptions.WorksheetNotFound:
-        ws = gc.open(SHEET_NAME).add_worksheet(title=ADMIN_LOGS_TAB, rows=100, cols=4)
-        ws.append_row(["Timestamp", "AdminUser", "AdminAction", "Details"])
+    # Buffered per session and written in one batch by flush_admin_logs().
     timestamp = pd.Timestamp.now(tz='Europe/Berlin').strftime("%Y-%m-%d %H:%M:%S")
-    ws.append_row([timestamp, admin_user, action, details])
-
+    st.session_state.setdefault('admin_log_buffer', []).append([timestamp, admin_user, action, details])
+
+@track_helper
+def flush_admin_logs():
+    buffer = st.session_state.get('admin_log_buffer')
+    if not buffer:
+        return True
+    rows = list(buffer)
+    for attempt in range(ADMIN_LOG_FLUSH_ATTEMPTS):
+        try:
+            get_storage().append_admin_logs(rows)
+        except Exception:
+            if attempt + 1 < ADMIN_LOG_FLUSH_ATTEMPTS:
+                time.sleep(0.5 * 2 ** attempt)
+            continue
+        del buffer[:len(rows)]
+        return True
+    # Still buffered; the next rerun of this session tries again.
+    return False
+
+def rerun(scope="app"):
+    flush_admin_logs()
+    st.rerun(scope=scope)
+
+@track_helper
 def load_admin_logs(n=20):
-    gc = get_gsheet_client()
     try:
-        ws = gc.open(SHEET_NAME).worksheet(ADMIN_LOGS_TAB)
-        logs = get_as_dataframe(ws, evaluate_formulas=True).dropna(how='all')
-        logs = logs.fillna("")
+        logs = get_storage().load_admin_logs_frame(n)
         if not logs.empty:
-            return logs.tail(n).iloc[::-1]
+            return logs.iloc[::-1]
     except Exception:
         return pd.DataFrame(columns=["Timestamp", "AdminUser", "AdminAction", "Details"])
     return pd.DataFrame(columns=["Timestamp", "AdminUser", "AdminAction", "Details"])
 
 # ---- DUPLICATE HANDLING ----
-def append_pending_dupe(user, item, quantity):
-    gc = get_gsheet_client()
-    try:
-        ws = gc.open(SHEET_NAME).worksheet(PENDING_DUPES_TAB)
-    except gspread.exceptions.WorksheetNotFound:
-        ws = gc.open(SHEET_NAME).add_worksheet(title=PENDING_DUPES_TAB, rows=100, cols=3)
-        ws.append_row(["User", "Item", "Quantity"])
-    ws.append_row([user, item, quantity])
+@track_helper
+def append_pending_dupes(rows):
+    if rows:
+        get_storage().append_pending_dupes(rows)
 
+@track_helper
 def load_pending_dupes():
-    gc = get_gsheet_client()
     try:
-        ws = gc.open(SHEET_NAME).worksheet(PENDING_DUPES_TAB)
-        df = get_as_dataframe(ws, evaluate_formulas=True, dtype=str)
-        df = df.dropna(how='all')
-        if not df.empty:
-            df = df.fillna("")
-            expected_cols = ["User", "Item", "Quantity"]
-            for col in expected_cols:
-                if col not in df.columns:
-                    df[col] = ""
-            df = df[expected_cols]
-            df["Quantity"] = pd.to_numeric(df["Quantity"], errors="coerce").fillna(0).astype(int)
-        else:
-            df = pd.DataFrame(columns=["User", "Item", "Quantity"])
-        return df, ws
+        return get_storage().load_pending_dupes_frame()
     except Exception:
-        return pd.DataFrame(columns=["User", "Item", "Quantity"]), None
+        return pd.DataFrame(columns=["User", "Item", "Quantity", "ID"])
 
-def remove_pending_dupe(ws, row_idx):
-    ws.delete_rows(row_idx+2)  # +2: 1 for header, 1-based index
+@track_helper
+def remove_pending_dupes(dupe_ids):
+    return get_storage().remove_pending_dupes(dupe_ids)
 
 # ---- ADMIN LOGIN STATE HANDLING ----
 if 'is_editor' not in st.session_state:
@@ -241,37 +212,107 @@ def show_admin_login():
                 st.session_state['admin_user'] = ""
                 st.session_state['login_failed'] = True
 
-# ---- TOP-CENTER ADMIN LOGIN BUTTON OR LOGOUT ----
-col1, col2, col3 = st.columns([1,2,1])
-with col2:
-    if not st.session_state['is_editor']:
-        if st.button("Admin login"):
-            st.session_state['show_login'] = not st.session_state['show_login']
-    else:
-        if st.button("Admin logout"):
-            logout()
-
-if st.session_state['show_login'] and not st.session_state['is_editor']:
-    col_spacer1, col_login, col_spacer2 = st.columns([1,2,1])
-    with col_login:
-        show_admin_login()
-    if st.session_state['login_failed']:
-        st.error("Incorrect username or password.")
-
-if st.session_state['is_editor']:
-    st.caption(f"**Admin mode enabled: {st.session_state['admin_user']}**")
-else:
-    st.caption("**Read only mode** (progress & deposit info only)")
+# Sheets requests, cache lookups and helper timings of this run, for the diagnostics panel.
+st.session_state['run_metrics'] = start_run_metrics()
+
+# Entries left over from a rerun that failed before its logs were written.
+flush_admin_logs()
+
+# ---- PAGE SECTIONS ----
+# Each section below is a fragment: a click inside it reruns only that section and reloads only
+# the tabs listed here for it. Anything that changes what other sections show (logging in or out,
+# saving targets, adding or deleting deposits) goes through rerun(), which reruns the whole page.
+SECTION_TABS = {
+    "targets": [TARGETS_TAB],
+    "deposit": [],
+    "import": [],
+    "pending": [PENDING_DUPES_TAB],
+    "search": [SHEET_TAB, TARGETS_TAB],
+    "overview": [SHEET_TAB, TARGETS_TAB],
+    "history": [TARGETS_TAB],
+    "delete": [SHEET_TAB],
+    "logs": [ADMIN_LOGS_TAB],
+}
+EDITOR_SECTIONS = {"deposit", "import", "pending", "delete", "logs"}
+
+def page_tabs(is_editor):
+    tabs = []
+    for section, section_tabs in SECTION_TABS.items():
+        if is_editor or section not in EDITOR_SECTIONS:
+            tabs += [tab for tab in section_tabs if tab not in tabs]
+    return tabs
+
+def load_section(section):
+    prefetch(SECTION_TABS[section])
+
+def set_notice(section, kind, message):
+    # Shown by show_notice() the next time the section renders, i.e. after the rerun that follows a write.
+    st.session_state.setdefault('notices', {})[section] = (kind, message)
+
+def show_notice(section):
+    notice = st.session_state.get('notices', {}).pop(section, None)
+    if notice:
+        kind, message = notice
+        getattr(st, kind)(message)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_user_breakdown(ledger_version, item, target, divine_val, _totals):
+    # _totals isn't hashed; ledger_version identifies it.
+    return user_breakdown(_totals, item, {item: target}, {item: divine_val})
+
+def show_user_breakdown(ledger, item, targets, divines):
+    table = cached_user_breakdown(ledger.version, item, targets[item], divines[item], ledger.totals)
+    pages = max(1, -(-len(table) // BREAKDOWN_PAGE_SIZE))
+    if pages > 1:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=f"breakdown_page_{item}")
+        table = table.iloc[(page - 1) * BREAKDOWN_PAGE_SIZE:page * BREAKDOWN_PAGE_SIZE]
+    st.dataframe(table, use_container_width=True, column_config=PAYOUT_COLUMN_CONFIG)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def cached_holdings(ledger_version, targets, divines, _totals):
+    # Built once per ledger version and set of targets, then shared read-only by every session.
+    return UserHoldings(_totals, ALL_ITEMS, dict(targets), dict(divines))
+
+def load_page_targets():
+    targets, divines, bank_buy_pct_loaded = load_targets()
+    if 'bank_buy_pct' not in st.session_state:
+        st.session_state['bank_buy_pct'] = bank_buy_pct_loaded
+    return targets, divines
 
-# ---- DATA LOADING ----
-df = load_data()
-targets, divines, bank_buy_pct_loaded, ws_targets = load_targets()
+# ---- TOP-CENTER ADMIN LOGIN BUTTON OR LOGOUT ----
+@st.fragment
+def login_bar():
+    col1, col2, col3 = st.columns([1,2,1])
+    with col2:
+        if not st.session_state['is_editor']:
+            if st.button("Admin login"):
+                st.session_state['show_login'] = not st.session_state['show_login']
+        else:
+            if st.button("Admin logout"):
+                logout()
+                rerun()
+
+    if st.session_state['show_login'] and not st.session_state['is_editor']:
+        col_spacer1, col_login, col_spacer2 = st.columns([1,2,1])
+        with col_login:
+            show_admin_login()
+        if st.session_state['is_editor']:
+            rerun()
+        if st.session_state['login_failed']:
+            st.error("Incorrect username or password.")
 
-if 'bank_buy_pct' not in st.session_state:
-    st.session_state['bank_buy_pct'] = bank_buy_pct_loaded
+    if st.session_state['is_editor']:
+        st.caption(f"**Admin mode enabled: {st.session_state['admin_user']}**")
+    else:
+        st.caption("**Read only mode** (progress & deposit info only)")
 
-with st.sidebar:
+# ---- SIDEBAR TARGETS EDITOR ----
+@st.fragment
+def targets_sidebar():
+    load_section("targets")
+    targets, divines = load_page_targets()
     st.header("Per-Item Targets & Divine Value")
+    show_notice("targets")
     if st.session_state['is_editor']:
         st.subheader("Bank Instant Buy Settings")
         bank_buy_pct = st.number_input(
@@ -309,10 +350,10 @@ with st.sidebar:
             new_targets[item] = tgt
             new_divines[item] = div
         if st.button("Save Targets and Values") and changed:
-            save_targets(new_targets, new_divines, st.session_state['bank_buy_pct'], ws_targets)
+            save_targets(new_targets, new_divines, st.session_state['bank_buy_pct'])
             append_admin_log("Edit Targets/Values", "Admin updated targets or values.", st.session_state['admin_user'])
-            st.success("Targets, Divine values and Bank % saved! Refresh the page to see updates.")
-            st.stop()
+            set_notice("targets", "success", "Targets, Divine values and Bank % saved!")
+            rerun()
     else:
         for item in ALL_ITEMS:
             st.markdown(
@@ -324,235 +365,397 @@ with st.sidebar:
             )
 
 # --- MULTI-ITEM DEPOSIT FORM (EDITORS ONLY) ---
-if st.session_state['is_editor']:
+@st.fragment
+def deposit_form():
     if 'deposit_submitted' not in st.session_state:
         st.session_state['deposit_submitted'] = False
 
     with st.form("multi_item_deposit", clear_on_submit=True):
         st.subheader("Add a Deposit (multiple items per user)")
+        show_notice("deposit")
         user = st.text_input("User")
         col1, col2 = st.columns(2)
         item_qtys = {}
         for i, item in enumerate(ALL_ITEMS):
             col = col1 if i % 2 == 0 else col2
-            item_qtys[item] = col.number_input(f"{item}", min_value=0, step=1, key=f"add_{item}")
+            item_qtys[item] = col.number_input(f"{item}", min_value=0, max_value=QUANTITY_MAX, step=1,
+                                               key=f"add_{item}")
         submitted = st.form_submit_button("Add Deposit(s)")
         if submitted and user and not st.session_state['deposit_submitted']:
             # --------- RACE-SAFE DUPLICATE DETECTION & DEPOSIT ADDITION ---------
-            df_latest = load_data()
-            new_rows = []
-            for item, qty in item_qtys.items():
-                if qty > 0:
-                    is_duplicate = not df_latest[
-                        (df_latest["User"].str.lower() == user.strip().lower()) &
-                        (df_latest["Item"] == item) &
-                        (df_latest["Quantity"] == int(qty))
-                    ].empty
-                    if is_duplicate:
-                        append_pending_dupe(user.strip(), item, int(qty))
-                    else:
-                        new_rows.append({"User": user.strip(), "Item": item, "Quantity": int(qty)})
-            if new_rows:
-                # Before save, check AGAIN for race-safety
-                df_final = load_data()
-                actually_added = []
-                for row in new_rows:
-                    already_in = not df_final[
-                        (df_final["User"].str.lower() == row["User"].lower()) &
-                        (df_final["Item"] == row["Item"]) &
-                        (df_final["Quantity"] == row["Quantity"])
-                    ].empty
-                    if not already_in:
-                        df_final = pd.concat([df_final, pd.DataFrame([row])], ignore_index=True)
-                        actually_added.append(f"{row['Quantity']}x {row['Item']}")
-                        append_admin_log("Deposit", f"{row['User']}: {row['Quantity']}x {row['Item']}", st.session_state['admin_user'])
-                if actually_added:
-                    save_data(df_final)
+            requested = [{"User": user.strip(), "Item": item, "Quantity": int(qty)}
+                         for item, qty in item_qtys.items() if qty > 0]
+            if requested:
+                try:
+                    added, duplicates = commit_deposits(requested)
+                except ConcurrentDepositError as e:
+                    st.error(str(e))
+                    return
+                append_pending_dupes(duplicates)
+                for row in added:
+                    append_admin_log("Deposit", f"{row['User']}: {row['Quantity']}x {row['Item']}", st.session_state['admin_user'])
+                if added:
                     st.session_state['deposit_submitted'] = True
-                    st.success("Deposits added: " + ", ".join(actually_added))
-                    st.rerun()
+                    set_notice("deposit", "success", "Deposits added: " + ", ".join(f"{row['Quantity']}x {row['Item']}" for row in added))
+                    rerun()
                 else:
-                    st.info("All selected deposits were already present. No duplicates added.")
-            elif any(item_qtys[item] > 0 for item in item_qtys):
-                st.warning("Duplicate offer detected! Please confirm it in the admin panel below.")
+                    set_notice("deposit", "warning", "Duplicate offer detected! Please confirm it in the admin panel below.")
+                    # The pending panel is its own section, so rerun the page to show the new offer there.
+                    rerun()
             else:
                 st.warning("Please enter at least one item with quantity > 0.")
 
     if st.session_state.get('deposit_submitted', False) and not submitted:
         st.session_state['deposit_submitted'] = False
 
-st.markdown("---")
+# --- BULK CSV IMPORT (EDITORS ONLY) ---
+def describe_import(rows):
+    per_item = pd.DataFrame(rows).groupby("Item", sort=False)["Quantity"].sum()
+    users = len({row["User"].lower() for row in rows})
+    return f"{len(rows)} deposit(s) from {users} user(s): " + ", ".join(f"{qty}x {item}" for item, qty in per_item.items())
+
+def decode_upload(data):
+    # Excel on Windows saves "CSV" as Windows-1252 unless told to use UTF-8.
+    for encoding in ("utf-8-sig", "cp1252"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return None
+
+@st.fragment
+def bulk_import_panel():
+    with st.expander("Bulk import (CSV of user, item, quantity)", expanded=False):
+        show_notice("import")
+        # Bumped after an import so both inputs start out empty again.
+        import_round = st.session_state.setdefault('import_round', 0)
+        uploaded = st.file_uploader("Upload a CSV file", type=["csv", "txt"], key=f"import_file_{import_round}")
+        pasted = st.text_area("...or paste lines", placeholder="user,item,quantity", key=f"import_text_{import_round}")
+        text = decode_upload(uploaded.getvalue()) if uploaded is not None else pasted
+        if text is None:
+            st.error("Couldn't read the uploaded file; save it as a UTF-8 CSV and try again.")
+            return
+        if not text.strip():
+            return
+
+        deposits, rejected = parse_deposit_import(text)
+        if not rejected.empty:
+            st.warning(f"{len(rejected)} line(s) will be skipped:")
+            st.dataframe(rejected, use_container_width=True, hide_index=True)
+        if deposits.empty:
+            st.info("No valid deposits to import.")
+            return
+        rows = deposits.to_dict("records")
+        st.caption(describe_import(rows))
+        if st.button(f"Import {len(rows)} deposit(s)", key="import_submit"):
+            # One ledger write for the whole batch; rows matching the ledger or an earlier line go to PendingDupes.
+            try:
+                added, duplicates = commit_deposits(rows)
+            except ConcurrentDepositError as e:
+                st.error(str(e))
+                return
+            append_pending_dupes(duplicates)
+            if added:
+                append_admin_log("Bulk Import", describe_import(added), st.session_state['admin_user'])
+            message = f"Imported {len(added)} deposit(s)."
+            if duplicates:
+                message += f" {len(duplicates)} suspected duplicate(s) were sent to the pending offers for confirmation."
+            set_notice("import", "success" if added else "warning", message)
+            st.session_state['import_round'] = import_round + 1
+            rerun()
 
 # ---- DUPLICATE OFFERS ADMIN PANEL ----
-if st.session_state['is_editor']:
+def describe_deposits(rows):
+    return ", ".join(f"{row['User']} - {row['Item']} ({row['Quantity']})" for row in rows)
+
+@st.fragment
+def pending_dupes_panel():
     st.header("Pending Duplicate Offers (confirm or decline)")
-    pending_dupes, ws_pending = load_pending_dupes()
-    if not pending_dupes.empty and ws_pending is not None:
-        for idx, row in pending_dupes.iterrows():
-            c = st.columns([2, 2, 2, 1, 1])
-            c[0].write(row['User'])
-            c[1].write(row['Item'])
-            c[2].write(row['Quantity'])
-            confirm_key = f"confirm_dupe_{idx}"
-            decline_key = f"decline_dupe_{idx}"
-            if c[3].button("Confirm", key=confirm_key):
-                # ------ RACE-SAFE: Check before confirming ------
-                df_latest = load_data()
-                already_in = not df_latest[
-                    (df_latest["User"].str.lower() == row["User"].strip().lower()) &
-                    (df_latest["Item"] == row["Item"]) &
-                    (df_latest["Quantity"] == int(row["Quantity"]))
-                ].empty
-                if already_in:
-                    st.info(f"Already exists: {row['User']} - {row['Item']} ({row['Quantity']})")
-                else:
-                    new_row = {"User": row["User"], "Item": row["Item"], "Quantity": row["Quantity"]}
-                    df_latest = pd.concat([df_latest, pd.DataFrame([new_row])], ignore_index=True)
-                    save_data(df_latest)
-                    append_admin_log("Confirm Duplicate", f"{row['User']} - {row['Item']} ({row['Quantity']})", st.session_state['admin_user'])
-                    st.success(f"Duplicate offer confirmed and added for {row['User']} - {row['Item']} ({row['Quantity']})")
-                remove_pending_dupe(ws_pending, idx)
-                st.rerun()
-            if c[4].button("Decline", key=decline_key):
-                remove_pending_dupe(ws_pending, idx)
-                append_admin_log("Decline Duplicate", f"{row['User']} - {row['Item']} ({row['Quantity']})", st.session_state['admin_user'])
-                st.info(f"Duplicate offer declined for {row['User']} - {row['Item']} ({row['Quantity']})")
-                st.rerun()
-    else:
+    show_notice("pending")
+    load_section("pending")
+    pending_dupes = load_pending_dupes()
+    if pending_dupes.empty:
         st.info("No pending duplicate offers.")
-
-st.markdown("---")
+        return
+
+    select_all = st.checkbox("Select all", key="pending_select_all")
+    grid = pending_dupes[["User", "Item", "Quantity", "ID"]].assign(Select=select_all)
+    # Rows are addressed by ID; a changed list of offers starts with a fresh selection.
+    edited = st.data_editor(
+        grid,
+        key=f"pending_grid_{hash(tuple(pending_dupes['ID']))}_{select_all}",
+        hide_index=True,
+        use_container_width=True,
+        disabled=["User", "Item", "Quantity", "ID"],
+        column_order=["Select", "User", "Item", "Quantity"],
+    )
+    selected = edited[edited["Select"]]
+    c = st.columns([1, 1, 4])
+    confirm = c[0].button(f"Confirm selected ({len(selected)})", disabled=selected.empty, key="confirm_selected")
+    decline = c[1].button(f"Decline selected ({len(selected)})", disabled=selected.empty, key="decline_selected")
+    rows = selected[["User", "Item", "Quantity", "ID"]].to_dict("records")
+    if confirm:
+        # ------ Confirmed offers are added as they are, in one write; each keeps its ID as the deposit ID, ------
+        # ------ so an offer confirmed twice (double click, two admins) is only booked once ------
+        added, existing = confirm_deposits(rows)
+        remove_pending_dupes(selected["ID"].tolist())
+        messages = []
+        if added:
+            append_admin_log("Confirm Duplicate", describe_deposits(added), st.session_state['admin_user'])
+            messages.append(f"Duplicate offers confirmed and added: {describe_deposits(added)}")
+        if existing:
+            messages.append(f"Already confirmed: {describe_deposits(existing)}")
+        set_notice("pending", "success" if added else "info", "\n\n".join(messages))
+        rerun()
+    if decline:
+        remove_pending_dupes(selected["ID"].tolist())
+        append_admin_log("Decline Duplicate", describe_deposits(rows), st.session_state['admin_user'])
+        set_notice("pending", "info", f"Duplicate offers declined: {describe_deposits(rows)}")
+        # Nothing outside this panel changed.
+        rerun(scope="fragment")
+
+# ---- DEPOSITOR SEARCH ----
+@st.fragment
+def user_search_panel():
+    st.header("Find a Depositor")
+    query = st.text_input("User name (or its beginning)", key="user_search").strip()
+    if not query:
+        return
+    load_section("search")
+    ledger = load_ledger()
+    targets, divines = load_page_targets()
+    holdings = cached_holdings(ledger.version, tuple(targets.items()), tuple(divines.items()), ledger.totals)
+    matches = holdings.search(query, limit=USER_SEARCH_LIMIT)
+    if not matches:
+        st.info("No depositor matches that name.")
+        return
+    user = matches[0]
+    if len(matches) > 1:
+        more = "+" if len(matches) == USER_SEARCH_LIMIT else ""
+        user = st.selectbox(f"{len(matches)}{more} matching users", matches, key="user_search_pick")
+    table = holdings.user_table(user)
+    c = st.columns(3)
+    c[0].metric("Items deposited", int(table["Quantity"].sum()))
+    c[1].metric("Current value (Divines)", f"{table['Value (Divines)'].sum():.1f}")
+    c[2].metric("Payout after fee (Divines)", f"{table['Payout (Divines, after fee)'].sum():.1f}")
+    st.dataframe(table, use_container_width=True, hide_index=True, column_config=HOLDINGS_COLUMN_CONFIG)
 
 # ---- DEPOSITS OVERVIEW ----
-st.header("Deposits Overview")
-
-bank_buy_pct = st.session_state.get('bank_buy_pct', DEFAULT_BANK_BUY_PCT)
-
-for cat, items in ORIGINAL_ITEM_CATEGORIES.items():
-    color = CATEGORY_COLORS.get(cat, "#FFD700")
-    st.markdown(f"""
-    <div style='margin-top: 38px;'></div>
-    <h2 style="color:{color}; font-weight:bold; margin-bottom: 14px;">{cat}</h2>
-    """, unsafe_allow_html=True)
-    item_totals = []
-    for item in items:
-        total = df[(df["Item"] == item)]["Quantity"].sum()
-        item_totals.append((item, total))
-    item_totals.sort(key=lambda x: x[1], reverse=True)
-    for item, total in item_totals:
-        item_color = get_item_color(item)
-        item_df = df[df["Item"] == item]
-        target = targets[item]
-        divine_val = divines[item]
-        divine_total = (total / target * divine_val) if target > 0 else 0
-        instant_sell_price = (divine_val / target) * bank_buy_pct / 100 if target > 0 else 0
-
-        extra_info = ""
-        if divine_val > 0 and target > 0:
-            extra_info = (f"<span style='margin-left:22px; color:#AAA;'>"
-                          f"[Stack = {divine_val:.2f} Divines → Current Value ≈ {divine_total:.2f} Divines | "
-                          f"Instant Sell: <span style='color:#fa0;'>{instant_sell_price:.3f} Divines</span> <span style='font-size:85%; color:#888;'>(per item)</span>]</span>")
-        elif divine_val > 0:
-            extra_info = (f"<span style='margin-left:22px; color:#AAA;'>"
-                          f"[Stack = {divine_val:.2f} Divines → Current Value ≈ {divine_total:.2f} Divines]</span>")
-
-        st.markdown(
-            f"""
-            <div style='
-                display:flex; 
-                align-items:center; 
-                border: 2px solid #222; 
-                border-radius: 10px; 
-                margin: 8px 0 16px 0; 
-                padding: 10px 18px;
-                background: #181818;
-            '>
-                <span style='font-weight:bold; color:{item_color}; font-size:1.18em; letter-spacing:0.5px;'>
-                    [{item}]
-                </span>
-                <span style='margin-left:22px; font-size:1.12em; color:#FFF;'>
-                    <b>Deposited:</b> {total} / {target}
-                </span>
-                {extra_info}
-            </div>
-            """,
-            unsafe_allow_html=True
-        )
+@st.fragment
+def deposits_overview():
+    st.header("Deposits Overview")
+    load_section("overview")
+    ledger = load_ledger()
+    targets, divines = load_page_targets()
+
+    bank_buy_pct = st.session_state.get('bank_buy_pct', DEFAULT_BANK_BUY_PCT)
+    summary_table = item_summary(ledger.totals, ALL_ITEMS, targets, divines, bank_buy_pct)
+    record_progress(summary_table)
+
+    for cat, items in ORIGINAL_ITEM_CATEGORIES.items():
+        color = CATEGORY_COLORS.get(cat, "#FFD700")
+        st.markdown(f"""
+        <div style='margin-top: 38px;'></div>
+        <h2 style="color:{color}; font-weight:bold; margin-bottom: 14px;">{cat}</h2>
+        """, unsafe_allow_html=True)
+        cat_summary = summary_table.loc[items].sort_values("Total", ascending=False, kind="stable")
+        for item, summary in cat_summary.iterrows():
+            item_color = get_item_color(item)
+            total = int(summary["Total"])
+            target = int(summary["Target"])
+            divine_val = summary["Divines"]
+            divine_total = summary["DivineTotal"]
+            instant_sell_price = summary["InstantSell"]
+
+            extra_info = ""
+            if divine_val > 0 and target > 0:
+                extra_info = (f"<span style='margin-left:22px; color:#AAA;'>"
+                              f"[Stack = {divine_val:.2f} Divines → Current Value ≈ {divine_total:.2f} Divines | "
+                              f"Instant Sell: <span style='color:#fa0;'>{instant_sell_price:.3f} Divines</span> <span style='font-size:85%; color:#888;'>(per item)</span>]</span>")
+            elif divine_val > 0:
+                extra_info = (f"<span style='margin-left:22px; color:#AAA;'>"
+                              f"[Stack = {divine_val:.2f} Divines → Current Value ≈ {divine_total:.2f} Divines]</span>")
 
-        # GREEN BAR IF FULL, ELSE NORMAL
-        if total >= target:
-            st.success(f"✅ {total}/{target} – Target reached!")
-            st.markdown("""
-            <div style='height:22px; width:100%; background:#22c55e; border-radius:7px; display:flex; align-items:center;'>
-                <span style='margin-left:10px; color:white; font-weight:bold;'>FULL</span>
-            </div>
-            """, unsafe_allow_html=True)
-        else:
-            st.progress(min(total / target, 1.0), text=f"{total}/{target}")
-
-        # ---- Per-user breakdown & payout ----
-        with st.expander("Per-user breakdown & payout", expanded=False):
-            user_summary = (
-                item_df.groupby("User")["Quantity"]
-                .sum()
-                .sort_values(ascending=False)
-                .reset_index()
-            )
-            payouts = []
-            fees = []
-            for idx, row in user_summary.iterrows():
-                qty = row["Quantity"]
-                raw_payout = (qty / target) * divine_val if target else 0
-                fee = math.floor((raw_payout * 0.10) * 10) / 10
-                payout_after_fee = raw_payout - (raw_payout * 0.10)
-                payout_final = math.floor(payout_after_fee * 10) / 10
-                payouts.append(payout_final)
-                fees.append(fee)
-            user_summary["Fee (10%)"] = fees
-            user_summary["Payout (Divines, after fee)"] = payouts
-            st.dataframe(
-                user_summary.style.format({"Fee (10%)": "{:.1f}", "Payout (Divines, after fee)": "{:.1f}"}),
-                use_container_width=True
+            st.markdown(
+                f"""
+                <div style='
+                    display:flex;
+                    align-items:center;
+                    border: 2px solid #222;
+                    border-radius: 10px;
+                    margin: 8px 0 16px 0;
+                    padding: 10px 18px;
+                    background: #181818;
+                '>
+                    <span style='font-weight:bold; color:{item_color}; font-size:1.18em; letter-spacing:0.5px;'>
+                        [{item}]
+                    </span>
+                    <span style='margin-left:22px; font-size:1.12em; color:#FFF;'>
+                        <b>Deposited:</b> {total} / {target}
+                    </span>
+                    {extra_info}
+                </div>
+                """,
+                unsafe_allow_html=True
             )
 
-st.markdown("---")
-
-# ---- DELETE BUTTONS PER ROW (EDITORS ONLY), GROUPED BY ITEM IN EXPANDERS ----
-if st.session_state['is_editor']:
+            # GREEN BAR IF FULL, ELSE NORMAL
+            if total >= target:
+                st.success(f"✅ {total}/{target} – Target reached!")
+                st.markdown("""
+                <div style='height:22px; width:100%; background:#22c55e; border-radius:7px; display:flex; align-items:center;'>
+                    <span style='margin-left:10px; color:white; font-weight:bold;'>FULL</span>
+                </div>
+                """, unsafe_allow_html=True)
+            else:
+                st.progress(summary["Progress"], text=f"{total}/{target}")
+
+            # ---- Per-user breakdown & payout, only built once it's switched on ----
+            if st.toggle("Per-user breakdown & payout", key=f"breakdown_{item}"):
+                show_user_breakdown(ledger, item, targets, divines)
+
+# ---- PROGRESS HISTORY ----
+@st.cache_data(show_spinner=False, max_entries=64)
+def cached_category_chart(history_version, category, targets, _history):
+    # _history isn't hashed; history_version identifies it. PNG bytes, drawn once per version.
+    return render_category_chart(_history, category, ORIGINAL_ITEM_CATEGORIES[category], dict(targets),
+                                 _history.last_timestamp)
+
+@st.fragment
+def progress_history_panel():
+    # Charts are drawn only when switched on, and then at most once per history version.
+    if not st.toggle("Progress history (fill rate and time to target)", key="show_history"):
+        return
+    history = get_history().history()
+    if history.deltas.empty:
+        st.info("No snapshots yet.")
+        return
+    load_section("history")
+    targets, _ = load_page_targets()
+    for category in ORIGINAL_ITEM_CATEGORIES:
+        st.image(cached_category_chart(history.version, category, tuple(targets.items()), history))
+    st.caption(f"Last snapshot: {history.last_timestamp:%Y-%m-%d %H:%M} UTC")
+
+# ---- BULK DELETE GRID (EDITORS ONLY), FILTERED AND PAGINATED ----
+@st.fragment
+def delete_panel():
     st.header("Delete Deposits (permanently)")
-    if len(df):
-        for cat, items in ORIGINAL_ITEM_CATEGORIES.items():
-            color = CATEGORY_COLORS.get(cat, "#FFD700")
-            st.markdown(f'<h3 style="color:{color}; font-weight:bold;">{cat}</h3>', unsafe_allow_html=True)
-            cols = st.columns(len(items))
-            for idx, item in enumerate(items):
-                item_rows = df[df["Item"] == item].reset_index()
-                with cols[idx]:
-                    with st.expander(f"{item} ({len(item_rows)} deposits)", expanded=False):
-                        if not item_rows.empty:
-                            for i, row in item_rows.iterrows():
-                                c = st.columns([2, 2, 2, 1])
-                                c[0].write(row['User'])
-                                c[1].write(row['Item'])
-                                c[2].write(row['Quantity'])
-                                delete_button = c[3].button("Delete", key=f"delete_{row['index']}_{item}")
-                                if delete_button:
-                                    df = df.drop(row['index']).reset_index(drop=True)
-                                    save_data(df)
-                                    append_admin_log("Delete", f"{row['User']} - {row['Item']} ({row['Quantity']})", st.session_state['admin_user'])
-                                    st.success(f"Permanently deleted: {row['User']} - {row['Item']} ({row['Quantity']})")
-                                    st.rerun()
-                        else:
-                            st.info("No deposits for this item.")
-    else:
+    show_notice("delete")
+    load_section("delete")
+    ledger = load_ledger()
+    df = ledger.frame
+    if not len(df):
         st.info("No deposits yet!")
+        return
+
+    c = st.columns([2, 2, 1])
+    user_filter = c[0].text_input("Filter by user", key="delete_user_filter").strip()
+    item_filter = c[1].selectbox("Filter by item", ["All items"] + ALL_ITEMS, key="delete_item_filter")
+    matches = df
+    if item_filter != "All items":
+        matches = matches[matches["Item"] == item_filter]
+    if user_filter:
+        matches = matches[matches["User"].str.contains(user_filter, case=False, regex=False)]
+    pages = max(1, -(-len(matches) // DELETE_PAGE_SIZE))
+    page = c[2].number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key="delete_page")
+    page = min(page, pages)
+    if matches.empty:
+        st.info("No deposits match these filters.")
+        return
+
+    page_rows = matches.iloc[(page - 1) * DELETE_PAGE_SIZE:page * DELETE_PAGE_SIZE]
+    grid = page_rows[["User", "Item", "Quantity", "ID"]].assign(Delete=False)
+    # A new ledger version, filter or page starts with nothing ticked.
+    edited = st.data_editor(
+        grid,
+        key=f"delete_grid_{ledger.version}_{item_filter}_{user_filter}_{page}",
+        hide_index=True,
+        use_container_width=True,
+        disabled=["User", "Item", "Quantity", "ID"],
+        column_order=["Delete", "User", "Item", "Quantity"],
+    )
+    selected = edited[edited["Delete"]]
+    st.caption(f"{len(matches)} matching deposits, showing {len(page_rows)}; {len(selected)} selected.")
+    if st.button(f"Delete selected ({len(selected)})", disabled=selected.empty, key="delete_selected"):
+        rows = selected[["User", "Item", "Quantity"]].to_dict("records")
+        delete_deposits(selected["ID"].tolist())
+        append_admin_log("Delete", describe_deposits(rows), st.session_state['admin_user'])
+        set_notice("delete", "success", f"Permanently deleted {len(rows)} deposit(s): {describe_deposits(rows)}")
+        rerun()
 
 # ---- SHOW ADMIN LOGS ----
-if st.session_state['is_editor']:
-    st.markdown("---")
+@st.fragment
+def admin_logs_panel():
     st.header("Admin Logs (Last 20 actions)")
+    flush_admin_logs()
+    load_section("logs")
     logs = load_admin_logs(n=20)
     if logs.empty:
         st.info("No admin logs yet.")
     else:
         st.dataframe(logs, use_container_width=True, hide_index=True)
+
+# ---- DIAGNOSTICS (EDITORS ONLY) ----
+@st.fragment
+def diagnostics_panel():
+    with st.expander("Diagnostics (Sheets requests, cache, timings)", expanded=False):
+        scope = st.radio("Show", ["Last full page run", "Since app start"], horizontal=True, key="diagnostics_scope")
+        metrics = st.session_state['run_metrics'] if scope == "Last full page run" else PROCESS_METRICS
+        c = st.columns(5)
+        c[0].metric("Sheets requests", metrics.request_count)
+        c[1].metric("Cache hits", metrics.cache_hits)
+        c[2].metric("Cache misses", metrics.cache_misses)
+        c[3].metric("Coalesced reads", metrics.coalesced)
+        c[4].metric("Retries / throttled", f"{metrics.retries} / {metrics.throttled_seconds:.1f}s")
+        timing_columns = ["Calls", "Total (ms)", "Average (ms)"]
+        st.dataframe(pd.DataFrame(metrics.timings("helpers"), columns=["Helper"] + timing_columns),
+                     use_container_width=True, hide_index=True)
+        st.dataframe(pd.DataFrame(metrics.timings("requests"), columns=["Sheets request"] + timing_columns),
+                     use_container_width=True, hide_index=True)
+        mirror = getattr(get_storage(), "mirror", None)
+        if mirror is not None:
+            failures = mirror.failures()
+            c = st.columns(2)
+            c[0].metric("Writes waiting for Sheets", mirror.pending())
+            c[1].metric("Writes not mirrored", len(failures))
+            if failures:
+                st.dataframe(pd.DataFrame(
+                    [(op, len(arg) if isinstance(arg, list) else 1, str(error)) for op, arg, error in failures],
+                    columns=["Write", "Rows", "Error"]), use_container_width=True, hide_index=True)
+
+# ---- PAGE LAYOUT ----
+login_bar()
+
+# A full run fetches every tab the visible sections read in one batched request up front.
+prefetch(page_tabs(st.session_state['is_editor']))
+
+with st.sidebar:
+    targets_sidebar()
+
+if st.session_state['is_editor']:
+    deposit_form()
+    bulk_import_panel()
+
+st.markdown("---")
+
+if st.session_state['is_editor']:
+    pending_dupes_panel()
+
+st.markdown("---")
+
+user_search_panel()
+
+st.markdown("---")
+
+deposits_overview()
+progress_history_panel()
+
+st.markdown("---")
+
+if st.session_state['is_editor']:
+    delete_panel()
+
+if st.session_state['is_editor']:
+    st.markdown("---")
+    admin_logs_panel()
+    diagnostics_panel()
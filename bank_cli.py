@@ -0,0 +1,76 @@
+"""Headless payout report for end-of-league settlement.
+
+Computes fee and payout for every item and user without starting Streamlit,
+from a Sheet1/Targets CSV export, the app's local SQLite store, or the live
+Google Sheet:
+
+    python bank_cli.py --ledger Sheet1.csv --targets Targets.csv
+    python bank_cli.py --sqlite bank.sqlite3 --output payouts.csv
+    python bank_cli.py --credentials service_account.json --settle
+"""
+import argparse
+import json
+import os
+import sys
+
+import pandas as pd
+
+from bank_core import ALL_ITEMS, ledger_totals, parse_deposits, parse_targets, payout_report, settle_bank
+
+
+def read_csv_export(path):
+    return pd.read_csv(path, dtype=str)
+
+
+def load_sources(args):
+    """Return (ledger, raw targets frame) from whichever source was given."""
+    if args.ledger:
+        ledger = parse_deposits(read_csv_export(args.ledger))
+        targets = read_csv_export(args.targets) if args.targets else pd.DataFrame()
+        return ledger, targets
+
+    # bank_storage is only needed for these two sources.
+    from bank_storage import SheetsStorage, SQLiteStorage
+
+    if args.sqlite:
+        storage = SQLiteStorage(args.sqlite, read_only=True)
+    else:
+        with open(args.credentials) as f:
+            storage = SheetsStorage(json.load(f))
+    return storage.load_ledger().frame, storage.load_targets_frame()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute the full bank payout report as CSV.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--ledger", help="CSV export of Sheet1 (User, Item, Quantity[, ID])")
+    source.add_argument("--sqlite", help="path to the app's SQLite store")
+    source.add_argument("--credentials", help="service account JSON for reading the live sheet")
+    parser.add_argument("--targets", help="CSV export of the Targets tab (with --ledger)")
+    parser.add_argument("--item", action="append", dest="items",
+                        help="only report this item (repeatable; default: all items)")
+    parser.add_argument("--settle", action="store_true",
+                        help="only report items that reached their target, and print the per-item "
+                             "reconciliation (tenths of a Divine) to stderr")
+    parser.add_argument("--output", help="write the report here instead of stdout")
+    args = parser.parse_args(argv)
+    if args.targets and not args.ledger:
+        parser.error("--targets only applies to --ledger")
+    if args.sqlite and not os.path.isfile(args.sqlite):
+        parser.error(f"no SQLite store at {args.sqlite}")
+
+    items = args.items or ALL_ITEMS
+    ledger, raw_targets = load_sources(args)
+    targets, divines, _ = parse_targets(raw_targets, items)
+    totals = ledger_totals(ledger)
+    if args.settle:
+        report, settlement = settle_bank(totals, items, targets, divines)
+        print(settlement.to_string(), file=sys.stderr)
+    else:
+        report = payout_report(totals, items, targets, divines)
+    report.to_csv(args.output or sys.stdout, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
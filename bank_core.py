@@ -0,0 +1,454 @@
+"""Bank configuration and calculations shared by the Streamlit app and offline tooling.
+
+Nothing in here touches Streamlit or Google Sheets, so it can be imported,
+benchmarked and batch-run (see bank_cli.py) on its own.
+"""
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# ---- CONFIGURATION ----
+ORIGINAL_ITEM_CATEGORIES = {
+    "Waystones": [
+        "Waystone EXP + Delirious",
+        "Waystone EXP 35%",
+        "Waystone EXP"
+    ],
+    "White Item Bases": [
+        "Stellar Amulet",
+        "Breach ring level 82",
+        "Heavy Belt"
+    ],
+    "Tablets": [
+        "Tablet Exp 9%+10% (random)",
+        "Quantity Tablet (6%+)",
+        "Grand Project Tablet"
+    ],
+    "Various": [
+        "Logbook level 79-80"
+    ]
+}
+ALL_ITEMS = sum(ORIGINAL_ITEM_CATEGORIES.values(), [])
+
+DEFAULT_BANK_BUY_PCT = 80   # percent
+DEFAULT_TARGET = 100
+SETTINGS_ROW = "_SETTINGS"   # Targets row holding bank_buy_pct in its Target column
+PAYOUT_FEE_PCT = 10   # percent of each payout kept by the bank
+DIVINE_SCALE = 100   # Divine values are fixed-point to 0.01, as entered in the app
+
+# Ledger columns; "ID" is a stable per-deposit key used to address single rows.
+DEPOSIT_COLUMNS = ["User", "Item", "Quantity", "ID"]
+# DepositIndex packs (user, item, quantity) into one int64: 21 + 10 + 32 bits.
+INDEX_USER_BITS = 21
+INDEX_ITEM_BITS = 10
+# Largest quantity a deposit can carry; parsed ledgers store Quantity as int32.
+QUANTITY_MAX = 2 ** 31 - 1
+# Columns of a bulk deposit import (see parse_deposit_import).
+IMPORT_COLUMNS = ["User", "Item", "Quantity"]
+# Parsed ledgers also carry UserKey, the normalize_user() form of User.
+LEDGER_COLUMNS = DEPOSIT_COLUMNS + ["UserKey"]
+USER_TABLE_COLUMNS = ["User", "Quantity", "Fee (10%)", "Payout (Divines, after fee)"]
+REPORT_COLUMNS = ["Item", "Target", "Stack Value (Divines)"] + USER_TABLE_COLUMNS
+HOLDINGS_COLUMNS = ["User", "Item", "Quantity", "Value (Divines)", "Fee (10%)", "Payout (Divines, after fee)"]
+# Per-item settlement; everything but Total/Target is in tenths of a Divine.
+SETTLEMENT_COLUMNS = ["Total", "Target", "Value", "Fees", "Payouts", "Dust"]
+
+
+# ---- PARSING ----
+def parse_deposits(raw):
+    """Turn a raw Sheet1 frame (strings, blanks as NaN) into a compact_ledger().
+
+    Quantities that aren't numbers or don't fit in int32 are read as 0, like
+    blanks, rather than being clipped to a wrong value.
+    """
+    df = raw.dropna(how='all')
+    if not df.empty:
+        df = df.fillna("")
+        for col in DEPOSIT_COLUMNS:
+            if col not in df.columns:
+                df[col] = ""
+        df = df[DEPOSIT_COLUMNS]
+    else:
+        df = pd.DataFrame(columns=DEPOSIT_COLUMNS)
+    quantity = pd.to_numeric(df["Quantity"], errors="coerce")
+    df["Quantity"] = quantity.where(quantity.abs() <= QUANTITY_MAX).fillna(0)
+    return compact_ledger(df)
+
+
+def parse_deposit_import(text, items=ALL_ITEMS):
+    """Validate CSV text of user,item,quantity lines (header optional); returns (deposits, rejected).
+
+    ``deposits`` has IMPORT_COLUMNS with the canonical item names (matched
+    case-insensitively) and int quantities. ``rejected`` lists every other
+    line with its Line number and a Reason: a missing user, an item not in
+    ORIGINAL_ITEM_CATEGORIES or a quantity that isn't a positive whole number.
+    """
+    reader = csv.reader(io.StringIO(text), skipinitialspace=True)
+    records, lines = [], []
+    for row in reader:
+        if any(cell.strip() for cell in row):
+            records.append((row + ["", "", ""])[:3])
+            lines.append(reader.line_num)
+    raw = pd.DataFrame(records, columns=IMPORT_COLUMNS, dtype=str)
+    raw.insert(0, "Line", pd.Series(lines, dtype=int))
+    if records and [cell.strip().lower() for cell in records[0]] == [col.lower() for col in IMPORT_COLUMNS]:
+        raw = raw.iloc[1:]
+
+    user = raw["User"].str.strip()
+    item = raw["Item"].str.strip().str.lower().map({name.lower(): name for name in items})
+    quantity = pd.to_numeric(raw["Quantity"].str.strip(), errors="coerce")
+    whole = (quantity > 0) & (quantity <= QUANTITY_MAX) & (quantity == np.floor(quantity))
+    reason = pd.Series(np.select(
+        [user == "", item.isna(), ~whole],
+        ["missing user", "unknown item", "quantity must be a positive whole number"],
+        default=""), index=raw.index)
+    ok = reason == ""
+    deposits = pd.DataFrame({
+        "User": user[ok], "Item": item[ok], "Quantity": quantity[ok].astype(np.int64),
+    }, columns=IMPORT_COLUMNS).reset_index(drop=True)
+    rejected = raw[~ok].assign(Reason=reason[~ok]).reset_index(drop=True)
+    return deposits, rejected
+
+
+def compact_ledger(df):
+    """Dictionary-encoded ledger (LEDGER_COLUMNS) built from User, Item, Quantity and ID columns.
+
+    User, Item and UserKey are categoricals and Quantity is int32 (a larger
+    quantity raises ValueError, see parse_deposits), so item and user filters
+    compare small integer codes instead of strings, and a million-row ledger
+    takes a fraction of the memory. ID stays a string column; it is unique
+    per row. The frame is meant to be shared between sessions: derive new
+    frames from it rather than modifying it in place.
+    """
+    users = df["User"].astype(str).astype("category")
+    keys = pd.Categorical(users.cat.categories.str.strip().str.lower())
+    user_key = pd.Categorical.from_codes(
+        np.where(users.cat.codes.to_numpy() >= 0, keys.codes[users.cat.codes.to_numpy()], -1),
+        categories=keys.categories,
+    )
+    quantity = pd.to_numeric(df["Quantity"])
+    if (quantity.abs() > QUANTITY_MAX).any():
+        raise ValueError(f"Quantity out of range (at most {QUANTITY_MAX}): {quantity.abs().max()}")
+    return pd.DataFrame({
+        "User": users.array,
+        "Item": pd.Categorical(df["Item"].astype(str)),
+        "Quantity": quantity.to_numpy().astype(np.int32),
+        "ID": df["ID"].astype(str).to_numpy(dtype=object),
+        "UserKey": user_key,
+    })
+
+
+def concat_ledgers(frames):
+    """Stack compact_ledger() frames without decoding their categoricals."""
+    columns = {}
+    for col in LEDGER_COLUMNS:
+        parts = [frame[col] for frame in frames]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            columns[col] = union_categoricals(parts)
+        else:
+            columns[col] = np.concatenate([part.to_numpy() for part in parts])
+    return pd.DataFrame(columns)
+
+
+def _finite(values):
+    # Numeric cells as floats; blanks, text and infinities become NaN.
+    values = pd.to_numeric(values, errors="coerce")
+    return values.where(np.isfinite(values))
+
+
+def parse_targets(df, items=ALL_ITEMS):
+    """Read (targets, divines, bank_buy_pct) from a raw Targets frame, with defaults for missing items."""
+    df = df.dropna(how='all')
+    targets = {}
+    divines = {}
+    bank_buy_pct = DEFAULT_BANK_BUY_PCT
+
+    if not df.empty and "Item" in df.columns:
+        settings_row = df[df["Item"] == SETTINGS_ROW]
+        if not settings_row.empty:
+            try:
+                bank_buy_pct = int(float(settings_row.iloc[0]["Target"]))
+            except Exception:
+                bank_buy_pct = DEFAULT_BANK_BUY_PCT
+        df = df[df["Item"] != SETTINGS_ROW]
+        target_vals = _finite(df["Target"]) if "Target" in df.columns else pd.Series(index=df.index, dtype=float)
+        divine_vals = _finite(df["Divines"]) if "Divines" in df.columns else pd.Series(index=df.index, dtype=float)
+        # Later rows for the same item win, as they did when the tab was read row by row.
+        targets = dict(zip(df["Item"], np.trunc(target_vals.fillna(DEFAULT_TARGET)).astype(int).tolist()))
+        divines = dict(zip(df["Item"], divine_vals.fillna(0).tolist()))
+    for item in items:
+        if item not in targets:
+            targets[item] = DEFAULT_TARGET
+        if item not in divines:
+            divines[item] = 0
+    return targets, divines, bank_buy_pct
+
+
+def target_changes(old, new, items=ALL_ITEMS):
+    """Targets tab cells ([Item, column, value]) that differ between two settings.
+
+    ``old`` and ``new`` are (targets, divines, bank_buy_pct) tuples as
+    returned by parse_targets(); bank_buy_pct lives in the Target column of
+    the SETTINGS_ROW.
+    """
+    old_targets, old_divines, old_pct = old
+    new_targets, new_divines, new_pct = new
+    cells = []
+    for item in items:
+        if new_targets[item] != old_targets.get(item):
+            cells.append([item, "Target", int(new_targets[item])])
+        if new_divines[item] != old_divines.get(item):
+            cells.append([item, "Divines", float(new_divines[item])])
+    if new_pct != old_pct:
+        cells.append([SETTINGS_ROW, "Target", int(new_pct)])
+    return cells
+
+
+# ---- AGGREGATION & PAYOUTS ----
+
+def ledger_totals(df):
+    """Total quantity per (Item, User); the only aggregation that scans the ledger.
+
+    The result is small (one row per pair), so Item and User come back as
+    plain string columns.
+    """
+    totals = (
+        df.groupby(["Item", "User"], sort=False, observed=True)["Quantity"]
+        .sum()
+        .astype(np.int64)
+        .reset_index()
+    )
+    return totals.astype({"Item": object, "User": object})
+
+
+def merge_totals(totals, new_rows):
+    """Fold freshly appended ledger rows into totals from ledger_totals()."""
+    if new_rows.empty:
+        return totals
+    return ledger_totals(pd.concat([totals, ledger_totals(new_rows)], ignore_index=True))
+
+
+def _fixed_point(quantity, target, divine_val):
+    # Integer operands for the settlement math: quantity, target (1 where unset) and Divines * DIVINE_SCALE.
+    qty = np.asarray(quantity, dtype=np.int64)
+    target = np.rint(np.asarray(target, dtype=float)).astype(np.int64)
+    divine_val = np.rint(np.asarray(divine_val, dtype=float) * DIVINE_SCALE).astype(np.int64)
+    has_target = target > 0
+    return qty * np.where(has_target, divine_val, 0), np.where(has_target, target, 1)
+
+
+def settle_tenths(quantity, target, divine_val):
+    """Exact (fee, payout) in tenths of a Divine for parallel arrays of deposits.
+
+    The raw payout is ``quantity / target * divine_val``; the bank keeps
+    PAYOUT_FEE_PCT of it and both parts are floored to 0.1 Divines. This is
+    done in int64 arithmetic, so results never come out 0.1 short at
+    boundaries the way float floors do. Pairs without a target get 0.
+    """
+    base, target = _fixed_point(quantity, target, divine_val)
+    denom = DIVINE_SCALE * 10 * target
+    return base * PAYOUT_FEE_PCT // denom, base * (100 - PAYOUT_FEE_PCT) // denom
+
+
+def stack_value_tenths(quantity, target, divine_val):
+    """Value of ``quantity`` items in whole tenths of a Divine (floored), as integers."""
+    base, target = _fixed_point(quantity, target, divine_val)
+    return base * 10 // (DIVINE_SCALE * target)
+
+
+def _add_payouts(per_user, target, divine_val):
+    # Each user's share of the stack value, minus the bank fee, floored to 0.1 Divines.
+    fee, payout = settle_tenths(per_user["Quantity"], per_user["Item"].map(target),
+                                per_user["Item"].map(divine_val))
+    per_user["Fee (10%)"] = fee / 10
+    per_user["Payout (Divines, after fee)"] = payout / 10
+    return per_user.sort_values(["Item", "Quantity"], ascending=[True, False], kind="stable")
+
+
+def payout_report(totals, items, targets, divines):
+    """Fee and payout for every (item, user) pair, one row each (see REPORT_COLUMNS)."""
+    target = pd.Series(targets, dtype=float).reindex(items).fillna(0)
+    divine_val = pd.Series(divines, dtype=float).reindex(items).fillna(0)
+    per_user = _add_payouts(totals[totals["Item"].isin(items)].copy(), target, divine_val)
+    per_user["Target"] = per_user["Item"].map(target).astype(int)
+    per_user["Stack Value (Divines)"] = per_user["Item"].map(divine_val)
+    return per_user[REPORT_COLUMNS].reset_index(drop=True)
+
+
+def settle_bank(totals, items, targets, divines, completed_only=True):
+    """Settle every item in one call: ``(payouts, settlement)``.
+
+    ``payouts`` is the payout_report() for the settled items. ``settlement``
+    is indexed by item (SETTLEMENT_COLUMNS) and reconciles exactly: Value,
+    the item's stack value in tenths, equals Fees + Payouts + Dust, where Dust
+    is what per-user flooring leaves with the bank. With ``completed_only``
+    only items whose total has reached their target are settled.
+    """
+    target = pd.Series(targets, dtype=float).reindex(items).fillna(0)
+    total = totals[totals["Item"].isin(items)].groupby("Item")["Quantity"].sum().reindex(items, fill_value=0)
+    if completed_only:
+        items = [item for item in items if target[item] > 0 and total[item] >= target[item]]
+    payouts = payout_report(totals, items, targets, divines)
+
+    divine_val = pd.Series(divines, dtype=float).reindex(items).fillna(0)
+    fee, payout = settle_tenths(payouts["Quantity"], payouts["Target"], payouts["Stack Value (Divines)"])
+    per_item = pd.DataFrame({"Item": payouts["Item"], "Fees": fee, "Payouts": payout})
+    per_item = per_item.groupby("Item")[["Fees", "Payouts"]].sum().reindex(items, fill_value=0)
+    settlement = pd.DataFrame({
+        "Total": total.reindex(items).astype(int),
+        "Target": target.reindex(items).astype(int),
+        "Value": stack_value_tenths(total.reindex(items), target.reindex(items), divine_val),
+        "Fees": per_item["Fees"],
+        "Payouts": per_item["Payouts"],
+    }, index=pd.Index(items, name="Item"))
+    settlement["Dust"] = settlement["Value"] - settlement["Fees"] - settlement["Payouts"]
+    return payouts, settlement[SETTLEMENT_COLUMNS]
+
+
+def item_summary(totals, items, targets, divines, bank_buy_pct):
+    """Per-item overview from the per-(item, user) ledger totals.
+
+    Indexed by item (in ``items`` order) with Total, Target, Divines,
+    Progress, DivineTotal and InstantSell columns.
+    """
+    target = pd.Series(targets, dtype=float).reindex(items).fillna(0)
+    divine_val = pd.Series(divines, dtype=float).reindex(items).fillna(0)
+    total = totals[totals["Item"].isin(items)].groupby("Item")["Quantity"].sum().reindex(items, fill_value=0)
+
+    has_target = target > 0
+    safe_target = target.where(has_target, 1)
+    return pd.DataFrame({
+        "Total": total.astype(int),
+        "Target": target.astype(int),
+        "Divines": divine_val,
+        "Progress": (total / safe_target).clip(upper=1.0).where(has_target, 0.0),
+        "DivineTotal": (total / safe_target * divine_val).where(has_target, 0.0),
+        "InstantSell": (divine_val / safe_target * bank_buy_pct / 100).where(has_target, 0.0),
+    })
+
+
+def user_breakdown(totals, item, targets, divines):
+    """One item's per-user table (USER_TABLE_COLUMNS), largest depositor first."""
+    target = pd.Series(targets, dtype=float).reindex([item]).fillna(0)
+    divine_val = pd.Series(divines, dtype=float).reindex([item]).fillna(0)
+    per_user = _add_payouts(totals[totals["Item"] == item].copy(), target, divine_val)
+    return per_user[USER_TABLE_COLUMNS].reset_index(drop=True)
+
+
+class UserHoldings:
+    """Every depositor's holdings across items: one HOLDINGS_COLUMNS row per (user, item).
+
+    Rows are sorted by normalized user name (see normalize_user; the same
+    key the duplicate check uses), so one user's rows are a contiguous slice
+    and a name prefix is found with two binary searches over the sorted
+    keys. Built from the per-(item, user) totals, like item_summary().
+    """
+
+    def __init__(self, totals, items, targets, divines):
+        report = payout_report(totals, items, targets, divines)
+        report["Value (Divines)"] = stack_value_tenths(
+            report["Quantity"], report["Target"], report["Stack Value (Divines)"]) / 10
+        report["UserKey"] = report["User"].astype(str).str.strip().str.lower()
+        report["Order"] = report["Item"].map({item: i for i, item in enumerate(items)})
+        report = report.sort_values(["UserKey", "Order"], kind="stable")
+        self.table = report[HOLDINGS_COLUMNS].reset_index(drop=True)
+        self.keys, self._starts = np.unique(report["UserKey"].to_numpy(dtype=str), return_index=True)
+        self._ends = np.append(self._starts[1:], len(self.table))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def search(self, prefix, limit=None):
+        """Normalized names of the users whose name starts with ``prefix``, in sorted order."""
+        prefix = normalize_user(prefix)
+        start = np.searchsorted(self.keys, prefix, side="left")
+        end = np.searchsorted(self.keys, prefix + "\U0010ffff", side="left")
+        return self.keys[start:end if limit is None else min(end, start + limit)].tolist()
+
+    def user_table(self, user):
+        """HOLDINGS_COLUMNS rows of one user (any spelling of the name), in item order."""
+        key = normalize_user(user)
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return self.table.iloc[:0]
+        return self.table.iloc[self._starts[i]:self._ends[i]].reset_index(drop=True)
+
+
+# ---- DUPLICATE DETECTION ----
+def normalize_user(user):
+    return str(user).strip().lower()
+
+
+def deposit_key(user, item, quantity):
+    """Key two deposits share when one is treated as a duplicate of the other."""
+    return normalize_user(user), item, int(quantity)
+
+
+class DepositIndex:
+    """Hash index of ledger deposits keyed by (normalized user, item, quantity).
+
+    Keys are stored as single integers built from the ledger's category codes,
+    so indexing a compact_ledger() never decodes its strings row by row.
+    """
+
+    def __init__(self, df):
+        if "UserKey" in df.columns:
+            users, items = df["UserKey"].array, df["Item"].array
+        else:
+            users = pd.Categorical(df["User"].astype(str).str.strip().str.lower())
+            items = pd.Categorical(df["Item"].astype(str))
+        self._user_codes = {user: code for code, user in enumerate(users.categories)}
+        self._item_codes = {item: code for code, item in enumerate(items.categories)}
+        keys = self._encode(users.codes.astype(np.int64), items.codes.astype(np.int64),
+                            df["Quantity"].to_numpy().astype(np.int64))
+        self._keys = set(keys.tolist())
+
+    @staticmethod
+    def _encode(user_code, item_code, quantity):
+        # User in the low bits so keys spread well in a hash set; quantity is offset into 0..2**32.
+        return ((quantity + 2 ** 31) << INDEX_ITEM_BITS | item_code) << INDEX_USER_BITS | user_code
+
+    @staticmethod
+    def _codes(values, table):
+        # Codes for a column of ``values``; values not seen before get the next free codes.
+        codes, uniques = pd.factorize(values)
+        mapping = np.array([table.setdefault(value, len(table)) for value in uniques], dtype=np.int64)
+        return mapping[codes]
+
+    def _key(self, user, item, quantity):
+        user, item, quantity = deposit_key(user, item, quantity)
+        user_code, item_code = self._user_codes.get(user), self._item_codes.get(item)
+        if user_code is None or item_code is None:
+            return None
+        return self._encode(user_code, item_code, quantity)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def contains(self, user, item, quantity):
+        key = self._key(user, item, quantity)
+        return key is not None and key in self._keys
+
+    def duplicate_mask(self, rows):
+        """Boolean array over a User/Item/Quantity frame: True where a row repeats
+        a ledger deposit or an earlier row of ``rows``.
+
+        The rows that aren't duplicates are added to the index.
+        """
+        users = self._codes(rows["User"].astype(str).str.strip().str.lower(), self._user_codes)
+        items = self._codes(rows["Item"].astype(str), self._item_codes)
+        keys = self._encode(users, items, rows["Quantity"].to_numpy().astype(np.int64))
+        duplicate = np.fromiter((key in self._keys for key in keys.tolist()), dtype=bool, count=len(keys))
+        duplicate |= pd.Series(keys).duplicated().to_numpy()
+        self._keys.update(keys[~duplicate].tolist())
+        return duplicate
+
+    def partition(self, rows):
+        """Split a list of deposit dicts into (new, duplicates), also catching repeats within ``rows``."""
+        duplicate = self.duplicate_mask(pd.DataFrame.from_records(rows, columns=IMPORT_COLUMNS))
+        new_rows = [row for row, dup in zip(rows, duplicate) if not dup]
+        duplicates = [row for row, dup in zip(rows, duplicate) if dup]
+        return new_rows, duplicates
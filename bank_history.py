@@ -0,0 +1,239 @@
+"""Progress history: periodic per-item snapshots and the charts drawn from them.
+
+Snapshots are stored as deltas: a row per item whose total or value changed
+since that item's previous row, so an idle bank writes nothing and the
+levels at any time are cumulative sums. Deltas add up, which makes
+compaction a plain group-and-sum: rows older than HISTORY_DAILY_AFTER_DAYS
+are merged into one per item per day, and older than
+HISTORY_WEEKLY_AFTER_DAYS into one per week. matplotlib is imported only
+when a chart is drawn.
+"""
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Seconds between two snapshots; the first full page run after that takes the next one.
+HISTORY_SNAPSHOT_SECONDS = int(os.environ.get("BANK_HISTORY_SNAPSHOT_SECONDS", "3600"))
+HISTORY_DAILY_AFTER_DAYS = 7
+HISTORY_WEEKLY_AFTER_DAYS = 60
+# Seconds between two compaction passes.
+HISTORY_COMPACT_SECONDS = 24 * 3600
+# Seconds before a failed snapshot write is tried again; doubles with each failure, up to HISTORY_SNAPSHOT_SECONDS.
+HISTORY_RETRY_SECONDS = 60
+# Days of history the time-to-target estimate takes the fill rate from.
+HISTORY_RATE_DAYS = 7
+# Each row is the change of Total (items) and Value (tenths of a Divine) since the item's previous row.
+HISTORY_COLUMNS = ["Timestamp", "Item", "Total", "Value"]
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"   # UTC
+
+
+def parse_history(raw):
+    """Turn a raw History frame (strings, blanks as NaN) into typed, time-ordered deltas."""
+    df = raw.dropna(how='all') if raw is not None else pd.DataFrame()
+    for col in HISTORY_COLUMNS:
+        if col not in df.columns:
+            df = df.assign(**{col: pd.Series(dtype=object)})
+    df = pd.DataFrame({
+        "Timestamp": pd.to_datetime(df["Timestamp"], format=TIMESTAMP_FORMAT, errors="coerce"),
+        "Item": df["Item"].fillna("").astype(str),
+        "Total": pd.to_numeric(df["Total"], errors="coerce").fillna(0).astype(np.int64),
+        "Value": pd.to_numeric(df["Value"], errors="coerce").fillna(0).astype(np.int64),
+    })
+    df = df[df["Timestamp"].notna() & (df["Item"] != "")]
+    return df.sort_values("Timestamp", kind="stable").reset_index(drop=True)
+
+
+class ProgressHistory:
+    """In-memory delta store; ``version`` changes whenever its content does."""
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.version = 0
+        levels = deltas.groupby("Item")[["Total", "Value"]].sum()
+        self.levels = {item: (int(row.Total), int(row.Value)) for item, row in levels.iterrows()}
+
+    @property
+    def last_timestamp(self):
+        return self.deltas["Timestamp"].max() if len(self.deltas) else None
+
+    def changes(self, totals, values, now):
+        """Delta rows that would record per-item ``totals`` and ``values`` (tenths) as of ``now``."""
+        rows = []
+        for item in totals.index:
+            total, value = int(totals[item]), int(values[item])
+            last_total, last_value = self.levels.get(item, (0, 0))
+            if total != last_total or value != last_value:
+                rows.append([now, item, total - last_total, value - last_value])
+        return rows
+
+    def add(self, rows):
+        """Append delta rows from changes() once they are stored."""
+        if not rows:
+            return
+        for _, item, total, value in rows:
+            last_total, last_value = self.levels.get(item, (0, 0))
+            self.levels[item] = (last_total + total, last_value + value)
+        self.deltas = pd.concat([self.deltas, pd.DataFrame(rows, columns=HISTORY_COLUMNS)], ignore_index=True)
+        self.version += 1
+
+    def compacted(self, now):
+        """The deltas with aged ones merged per item into days, then weeks; None if nothing would merge."""
+        df = self.deltas
+        age = now - df["Timestamp"]
+        bucket = df["Timestamp"].where(age < pd.Timedelta(days=HISTORY_DAILY_AFTER_DAYS), df["Timestamp"].dt.floor("D"))
+        bucket = bucket.where(age < pd.Timedelta(days=HISTORY_WEEKLY_AFTER_DAYS),
+                              df["Timestamp"].dt.to_period("W").dt.start_time)
+        # A merged row keeps its bucket's last timestamp, so the levels after it stay where they were.
+        merged = (df.assign(Bucket=bucket)
+                  .groupby(["Bucket", "Item"], sort=False)
+                  .agg(Timestamp=("Timestamp", "max"), Total=("Total", "sum"), Value=("Value", "sum"))
+                  .reset_index())
+        merged = merged[(merged["Total"] != 0) | (merged["Value"] != 0)]
+        if len(merged) == len(df):
+            return None
+        return merged[HISTORY_COLUMNS].sort_values("Timestamp", kind="stable").reset_index(drop=True)
+
+    def replace(self, deltas):
+        """Swap in compacted() deltas once they are stored; the levels stay the same."""
+        self.deltas = deltas
+        self.version += 1
+
+    def records(self, rows=None):
+        """Rows (a list or a deltas frame; all deltas by default) as HISTORY_COLUMNS lists ready to be stored."""
+        if rows is None:
+            rows = self.deltas
+        if isinstance(rows, pd.DataFrame):
+            rows = rows.values.tolist()
+        return [[pd.Timestamp(ts).strftime(TIMESTAMP_FORMAT), item, int(total), int(value)]
+                for ts, item, total, value in rows]
+
+    def levels_over_time(self, items, column="Total"):
+        """Cumulative ``column`` per item (columns) at every snapshot time (index)."""
+        if self.deltas.empty:
+            return pd.DataFrame(columns=items, dtype=float)
+        wide = self.deltas.pivot_table(index="Timestamp", columns="Item", values=column, aggfunc="sum")
+        return wide.reindex(columns=items).fillna(0).cumsum()
+
+
+def days_to_target(levels, targets, now, rate_days=HISTORY_RATE_DAYS):
+    """Estimated days until each item (a ``levels`` column) reaches its target.
+
+    Uses the fill rate over the last ``rate_days``: 0 for items already at
+    target, NaN where there is no target or no recent progress.
+    """
+    items = list(levels.columns)
+    target = pd.Series(targets, dtype=float).reindex(items).fillna(0)
+    if levels.empty:
+        return pd.Series(np.nan, index=items)
+    current = levels.iloc[-1]
+    since = max(now - pd.Timedelta(days=rate_days), levels.index[0])
+    start = levels[levels.index <= since].iloc[-1]
+    span_days = (now - since) / pd.Timedelta(days=1)
+    rate = (current - start) / span_days if span_days > 0 else current * 0
+    remaining = (target - current).clip(lower=0)
+    eta = (remaining / rate.where(rate > 0)).where(target > 0)
+    return eta.where(remaining > 0, 0.0).where(target > 0)
+
+
+def render_category_chart(history, category, items, targets, now):
+    """PNG of one category: fill rate over time and estimated days to target per item."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    levels = history.levels_over_time(items)
+    target = pd.Series(targets, dtype=float).reindex(items)
+    fill = levels.div(target.where(target > 0), axis=1) * 100
+    eta = days_to_target(levels, targets, now)
+
+    fig, (ax_fill, ax_eta) = plt.subplots(1, 2, figsize=(11, 3.2), gridspec_kw={"width_ratios": [2, 1]})
+    for item in items:
+        if item in fill.columns and fill[item].notna().any():
+            ax_fill.step(fill.index, fill[item], where="post", label=item)
+    ax_fill.axhline(100, color="#888", linewidth=0.8, linestyle="--")
+    ax_fill.set_title(f"{category}: fill rate")
+    ax_fill.set_ylabel("% of target")
+    if ax_fill.get_legend_handles_labels()[0]:
+        ax_fill.legend(fontsize="small", loc="upper left")
+    ax_fill.tick_params(axis="x", labelrotation=30, labelsize="small")
+
+    known = eta.dropna()
+    ax_eta.barh(list(known.index), known.to_numpy(), color="#42A5F5")
+    ax_eta.invert_yaxis()
+    ax_eta.set_title("Days to target")
+    ax_eta.tick_params(axis="y", labelsize="small")
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=90)
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+class HistoryRecorder:
+    """Takes the periodic snapshots for the whole process and keeps the history in memory.
+
+    The stored history is read once, on first use; after that snapshots and
+    compactions are written through to ``storage`` (any backend with
+    load_history_frame/append_history/replace_history), so showing the
+    history never reads the spreadsheet again. Memory only changes after a
+    write went through: a failed one leaves both as they were, and the
+    snapshot is tried again after HISTORY_RETRY_SECONDS, backing off while
+    the writes keep failing.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._history = None
+        self._last_snapshot = None
+        self._last_compacted = None
+        self._next_attempt = None
+        self._retry_seconds = HISTORY_RETRY_SECONDS
+        self._lock = threading.Lock()
+        # Held for a whole snapshot, writes included; page runs that find it taken just skip theirs.
+        self._snapshot_lock = threading.Lock()
+
+    def history(self):
+        with self._lock:
+            if self._history is None:
+                self._history = ProgressHistory(parse_history(self.storage.load_history_frame()))
+                self._last_snapshot = self._history.last_timestamp
+            return self._history
+
+    def maybe_snapshot(self, totals, values, now=None):
+        """Record ``totals``/``values`` (per item) if the last snapshot is HISTORY_SNAPSHOT_SECONDS old."""
+        history = self.history()
+        now = now or pd.Timestamp.now(tz="UTC").tz_localize(None).floor("s")
+        if not self._snapshot_lock.acquire(blocking=False):
+            return
+        try:
+            if self._next_attempt is not None and now < self._next_attempt:
+                return
+            if self._last_snapshot is not None and (now - self._last_snapshot).total_seconds() < HISTORY_SNAPSHOT_SECONDS:
+                return
+            try:
+                self._snapshot(history, totals, values, now)
+            except Exception:
+                self._next_attempt = now + pd.Timedelta(seconds=self._retry_seconds)
+                self._retry_seconds = min(2 * self._retry_seconds, HISTORY_SNAPSHOT_SECONDS)
+                raise
+            self._next_attempt = None
+            self._retry_seconds = HISTORY_RETRY_SECONDS
+        finally:
+            self._snapshot_lock.release()
+
+    def _snapshot(self, history, totals, values, now):
+        rows = history.changes(totals, values, now)
+        if rows:
+            self.storage.append_history(history.records(rows))
+            history.add(rows)
+        self._last_snapshot = now
+        if self._last_compacted is None or (now - self._last_compacted).total_seconds() >= HISTORY_COMPACT_SECONDS:
+            deltas = history.compacted(now)
+            if deltas is not None:
+                self.storage.replace_history(history.records(deltas))
+                history.replace(deltas)
+            self._last_compacted = now
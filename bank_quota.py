@@ -0,0 +1,180 @@
+"""Google Sheets request governor and request metrics.
+
+Every Sheets API request SheetsStorage makes goes through QuotaGovernor.call:
+it waits for a token from the read or write bucket (sized to the per-user
+per-minute quota), retries quota and server errors with jittered exponential
+backoff, and records the request in the metrics of the process and of the
+current rerun. Nothing here imports gspread or Streamlit.
+"""
+import functools
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+# Google's default quota is 60 read and 60 write requests per minute per user
+# (the service account). The buckets refill at that rate and allow short bursts.
+SHEETS_READS_PER_MINUTE = int(os.environ.get("BANK_SHEETS_READS_PER_MINUTE", 60))
+SHEETS_WRITES_PER_MINUTE = int(os.environ.get("BANK_SHEETS_WRITES_PER_MINUTE", 60))
+SHEETS_BURST = int(os.environ.get("BANK_SHEETS_BURST", 10))
+SHEETS_RETRY_ATTEMPTS = 5
+SHEETS_BACKOFF_SECONDS = 1.0   # first retry waits up to this long, doubling after each attempt
+SHEETS_BACKOFF_MAX_SECONDS = 32.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# gspread methods that only read; everything else counts against the write quota.
+READ_REQUESTS = {"open", "worksheet", "values_batch_get", "get", "get_all_values", "col_values"}
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is free; returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class RequestMetrics:
+    """Request, helper and cache counters for one rerun or for the whole process."""
+
+    def __init__(self):
+        self.requests = defaultdict(lambda: [0, 0.0])   # request name -> [count, seconds]
+        self.helpers = defaultdict(lambda: [0, 0.0])    # app helper name -> [count, seconds]
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_request(self, name, seconds):
+        with self._lock:
+            entry = self.requests[name]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_helper(self, name, seconds):
+        with self._lock:
+            entry = self.helpers[name]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_cache(self, hits=0, misses=0, coalesced=0):
+        with self._lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+            self.coalesced += coalesced
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def add_throttle(self, seconds):
+        with self._lock:
+            self.throttled_seconds += seconds
+
+    @property
+    def request_count(self):
+        return sum(count for count, _ in self.requests.values())
+
+    def timings(self, kind="requests"):
+        """[name, count, total ms, average ms] rows for ``requests`` or ``helpers``, slowest first."""
+        with self._lock:
+            entries = dict(getattr(self, kind))
+        rows = [[name, count, seconds * 1000, seconds * 1000 / count] for name, (count, seconds) in entries.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+PROCESS_METRICS = RequestMetrics()
+_local = threading.local()
+
+
+def start_run_metrics():
+    """Start fresh metrics for the calling thread (a Streamlit rerun) and return them."""
+    _local.metrics = RequestMetrics()
+    return _local.metrics
+
+
+def run_metrics():
+    return getattr(_local, "metrics", None)
+
+
+def record(method, *args):
+    # Counts go to the process totals and, if one was started, to the current rerun.
+    for metrics in (PROCESS_METRICS, run_metrics()):
+        if metrics is not None:
+            getattr(metrics, method)(*args)
+
+
+def track_helper(fn):
+    """Decorator timing a storage helper into the request metrics."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            record("add_helper", fn.__name__, time.perf_counter() - start)
+    return wrapper
+
+
+def _status(error):
+    status = getattr(error, "code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_transient(error):
+    """Whether a failed request may go through later: a quota or server error, or a network failure."""
+    # requests' connection and timeout errors are OSErrors, like socket errors.
+    return _status(error) in RETRYABLE_STATUS or isinstance(error, OSError)
+
+
+class QuotaGovernor:
+    """Rate-limits, retries and counts Sheets API requests; shared by every session of the process."""
+
+    def __init__(self, reads_per_minute=SHEETS_READS_PER_MINUTE, writes_per_minute=SHEETS_WRITES_PER_MINUTE,
+                 burst=SHEETS_BURST):
+        self.reads = TokenBucket(reads_per_minute, burst)
+        self.writes = TokenBucket(writes_per_minute, burst)
+
+    def call(self, fn, *args, **kwargs):
+        """Run one API request ``fn(*args, **kwargs)`` within the quota.
+
+        429 and 5xx errors are retried up to SHEETS_RETRY_ATTEMPTS times with
+        full-jitter exponential backoff; anything else is raised right away.
+        """
+        name = getattr(fn, "__name__", "request")
+        bucket = self.reads if name in READ_REQUESTS else self.writes
+        for attempt in range(SHEETS_RETRY_ATTEMPTS):
+            waited = bucket.acquire()
+            if waited:
+                record("add_throttle", waited)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt + 1 >= SHEETS_RETRY_ATTEMPTS or _status(e) not in RETRYABLE_STATUS:
+                    raise
+                record("add_retry")
+                time.sleep(random.uniform(0, min(SHEETS_BACKOFF_MAX_SECONDS, SHEETS_BACKOFF_SECONDS * 2 ** attempt)))
+            finally:
+                record("add_request", name, time.perf_counter() - start)
@@ -0,0 +1,1114 @@
+"""Storage backends for the item bank.
+
+SheetsStorage talks to the poe_item_bank spreadsheet directly.
+SQLiteStorage keeps the same data in a local database, and MirroredStorage
+uses it as the primary store while a background worker copies every change
+to the spreadsheet in batches (write-behind), so the sheet stays readable
+for the community without being on the request path. Changes wait in an
+outbox table of the database until Sheets has them, so they survive a
+restart.
+
+All backends expose the same methods; the Streamlit app only talks to
+whatever open_storage() returns. gspread and google-auth are imported only
+once a SheetsStorage actually connects, so local-only tooling (bank_cli.py
+on a CSV export or SQLite file) never pays for them.
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from bank_core import (
+    DEPOSIT_COLUMNS, DepositIndex, compact_ledger, concat_ledgers, ledger_totals, merge_totals, normalize_user,
+    parse_deposits,
+)
+from bank_history import HISTORY_COLUMNS
+from bank_quota import QuotaGovernor, is_transient, record
+
+logger = logging.getLogger(__name__)
+
+SHEET_NAME = "poe_item_bank"
+SHEET_TAB = "Sheet1"
+TARGETS_TAB = "Targets"
+ADMIN_LOGS_TAB = "AdminLogs"
+PENDING_DUPES_TAB = "PendingDupes"
+HISTORY_TAB = "History"
+
+TARGET_COLUMNS = ["Item", "Target", "Divines"]
+ADMIN_LOG_COLUMNS = ["Timestamp", "AdminUser", "AdminAction", "Details"]
+PENDING_DUPE_COLUMNS = ["User", "Item", "Quantity", "ID"]
+
+# Size and header row used when a tab is missing and has to be created.
+TAB_LAYOUTS = {
+    SHEET_TAB: {"rows": 1000, "cols": 4, "header": DEPOSIT_COLUMNS},
+    TARGETS_TAB: {"rows": 50, "cols": 3, "header": TARGET_COLUMNS},
+    ADMIN_LOGS_TAB: {"rows": 100, "cols": 4, "header": ADMIN_LOG_COLUMNS},
+    PENDING_DUPES_TAB: {"rows": 100, "cols": 4, "header": PENDING_DUPE_COLUMNS},
+    HISTORY_TAB: {"rows": 1000, "cols": 4, "header": HISTORY_COLUMNS},
+}
+
+# Seconds a tab read is shared between sessions before it is fetched again.
+CACHE_TTL_SECONDS = int(os.environ.get("BANK_CACHE_TTL_SECONDS", "30"))
+# Seconds between full Sheet1 reloads; in between only appended rows are fetched.
+LEDGER_FULL_SYNC_SECONDS = int(os.environ.get("BANK_LEDGER_FULL_SYNC_SECONDS", "600"))
+# How often a deposit commit retries when another admin changes the ledger under it.
+DEPOSIT_COMMIT_ATTEMPTS = 3
+
+# "sqlite" (local primary store mirrored to Sheets) or "sheets" (Sheets only).
+STORAGE_BACKEND = os.environ.get("BANK_STORAGE", "sqlite")
+# Keep it on persistent disk: changes not yet mirrored to Sheets only exist in this file.
+SQLITE_PATH = os.environ.get("BANK_SQLITE_PATH", "bank.sqlite3")
+# Seconds the mirror worker waits to collect more changes into one batch.
+MIRROR_BATCH_SECONDS = 1.0
+# Seconds open_storage waits for changes left over from a previous run to reach Sheets.
+MIRROR_REPLAY_SECONDS = 30
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+
+# Parsed ledger plus its (item, user) totals; version changes whenever the content does.
+LedgerSnapshot = namedtuple("LedgerSnapshot", ["frame", "totals", "version"])
+
+
+class ConcurrentDepositError(RuntimeError):
+    pass
+
+
+def new_deposit_id():
+    return uuid.uuid4().hex[:12]
+
+
+def _deposit_records(rows):
+    # Also used for pending duplicates, which carry the same columns and IDs.
+    return [{"User": row["User"], "Item": row["Item"], "Quantity": int(row["Quantity"]),
+             "ID": row.get("ID") or new_deposit_id()} for row in rows]
+
+
+def _values_to_frame(values):
+    # Same shape get_as_dataframe(dtype=str) gives: header row as columns, blank cells as NaN.
+    if not values:
+        return pd.DataFrame()
+    header = [str(cell) for cell in values[0]]
+    width = len(header)
+    rows = [[str(cell) for cell in row[:width]] + [""] * (width - len(row)) for row in values[1:]]
+    df = pd.DataFrame(rows, columns=header, dtype=object)
+    return df.mask(df == "")
+
+
+def _parse_pending(raw):
+    df = raw.dropna(how='all')
+    if not df.empty:
+        df = df.fillna("")
+        for col in PENDING_DUPE_COLUMNS:
+            if col not in df.columns:
+                df[col] = ""
+        df = df[PENDING_DUPE_COLUMNS]
+        df["Quantity"] = pd.to_numeric(df["Quantity"], errors="coerce").fillna(0).astype(int)
+        df["ID"] = df["ID"].astype(str)
+    else:
+        df = pd.DataFrame(columns=PENDING_DUPE_COLUMNS)
+    return df
+
+
+def _json_scalar(value):
+    # numpy integers and floats, e.g. quantities or target values taken straight from a DataFrame.
+    return value.item()
+
+
+def _snapshot(frame, version):
+    return LedgerSnapshot(frame, ledger_totals(frame), version)
+
+
+# ---- GOOGLE SHEETS ----
+class TabCache:
+    """Read-through cache of raw tab contents, shared by every session in the process.
+
+    Sessions that miss on a tab another session is already fetching wait for
+    that read instead of issuing the same request again.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._generations = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, tabs, fetch, fresh=False):
+        """Return {tab: value}, fetching every missing or expired tab with one fetch(tabs) call."""
+        values = {}
+        generations = {}
+        waiting = {}
+        with self._lock:
+            now = time.monotonic()
+            for tab in tabs:
+                entry = self._entries.get(tab)
+                if not fresh and entry is not None and now - entry[0] < self.ttl:
+                    values[tab] = entry[1]
+                elif not fresh and tab in self._inflight:
+                    waiting[tab] = self._inflight[tab]
+                else:
+                    generations[tab] = self._generations.get(tab, 0)
+            leading = {tab: threading.Event() for tab in generations if tab not in self._inflight}
+            self._inflight.update(leading)
+        record("add_cache", len(values), len(generations), len(waiting))
+        if generations:
+            try:
+                fetched = fetch(list(generations))
+                with self._lock:
+                    for tab, generation in generations.items():
+                        # Don't store a read that raced with a write to the same tab.
+                        if self._generations.get(tab, 0) == generation:
+                            self._entries[tab] = (time.monotonic(), fetched[tab])
+            finally:
+                with self._lock:
+                    for tab, done in leading.items():
+                        del self._inflight[tab]
+                        done.set()
+            values.update(fetched)
+        for tab, done in waiting.items():
+            done.wait()
+            with self._lock:
+                entry = self._entries.get(tab)
+            # The read we waited for failed or raced with a write; fetch it ourselves.
+            values[tab] = entry[1] if entry is not None else self.get_many([tab], fetch, fresh=True)[tab]
+        return values
+
+    def invalidate(self, *tabs):
+        with self._lock:
+            for tab in tabs or list(self._entries):
+                self._entries.pop(tab, None)
+                self._generations[tab] = self._generations.get(tab, 0) + 1
+
+
+def _trim_row(row):
+    row = [str(cell) for cell in row[:len(DEPOSIT_COLUMNS)]]
+    while row and row[-1] == "":
+        row.pop()
+    return row
+
+
+class LedgerSync:
+    """Keeps Sheet1 in sync by fetching only the rows appended since the last read.
+
+    Each delta read starts at the last row already known. If that row came
+    back unchanged, everything after it is new and gets parsed and merged on
+    its own; if not, rows were edited or deleted and the caller falls back to
+    a full reload. Edits above the last known row only show up on the next
+    full reload (every LEDGER_FULL_SYNC_SECONDS, or after our own deletes).
+    Only the header and that last row are kept in raw form; the ledger
+    itself lives in the snapshot's compact frame.
+    """
+
+    def __init__(self):
+        self._row_count = None
+        self._header = None
+        self._last_row = None
+        self._snapshot = None
+        self._full_sync_at = 0.0
+        self._lock = threading.Lock()
+
+    def start_row(self):
+        """First sheet row to request, or None when a full reload is due."""
+        with self._lock:
+            if self._row_count is None or time.monotonic() - self._full_sync_at > LEDGER_FULL_SYNC_SECONDS:
+                return None
+            return self._row_count
+
+    def reset(self):
+        with self._lock:
+            self._row_count = None
+
+    def apply(self, start_row, values):
+        """Merge rows read from ``start_row`` on (None = whole sheet); returns None if a full reload is needed."""
+        rows = [_trim_row(row) for row in values]
+        with self._lock:
+            if start_row is None:
+                version = self._snapshot.version + 1 if self._snapshot else 1
+                self._snapshot = _snapshot(parse_deposits(_values_to_frame(rows)), version)
+                rows = rows or [DEPOSIT_COLUMNS]
+                self._header, self._last_row, self._row_count = rows[0], rows[-1], len(rows)
+                self._full_sync_at = time.monotonic()
+                return self._snapshot
+            # A delta read that raced with another one is simply redone as a full reload.
+            if self._row_count is None or start_row != self._row_count:
+                return None
+            if not rows or rows[0] != self._last_row:
+                return None
+            new_rows = rows[1:]
+            if new_rows:
+                added = parse_deposits(_values_to_frame([self._header] + new_rows))
+                frame = concat_ledgers([self._snapshot.frame, added])
+                totals = merge_totals(self._snapshot.totals, added)
+                self._snapshot = LedgerSnapshot(frame, totals, self._snapshot.version + 1)
+                self._last_row = new_rows[-1]
+                self._row_count += len(new_rows)
+            return self._snapshot
+
+
+READ_PARAMS = {"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING"}
+
+
+def _tab_range(tab, start_row=None):
+    if tab != SHEET_TAB:
+        return None
+    return "A:D" if start_row is None else f"A{start_row}:D"
+
+
+class SheetsStorage:
+    """Reads and writes the poe_item_bank spreadsheet.
+
+    The client is authorized once and the spreadsheet and worksheet handles
+    are kept for the lifetime of the object; the credentials refresh their
+    access token on their own when it expires.
+    """
+
+    def __init__(self, credentials_info, sheet_name=SHEET_NAME):
+        self._credentials_info = credentials_info
+        self._sheet_name = sheet_name
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._lock = threading.Lock()
+        self.cache = TabCache(CACHE_TTL_SECONDS)
+        self.ledger_sync = LedgerSync()
+        self.quota = QuotaGovernor()
+
+    def request(self, fn, *args, **kwargs):
+        """Make one Sheets API request through the quota governor (see bank_quota)."""
+        return self.quota.call(fn, *args, **kwargs)
+
+    # -- connection --
+    def get_spreadsheet(self):
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        with self._lock:
+            if self._spreadsheet is None:
+                credentials = Credentials.from_service_account_info(self._credentials_info, scopes=SCOPES)
+                self._spreadsheet = self.request(gspread.authorize(credentials).open, self._sheet_name)
+            return self._spreadsheet
+
+    def get_worksheet(self, tab):
+        import gspread
+
+        if tab in self._worksheets:
+            return self._worksheets[tab]
+        sh = self.get_spreadsheet()
+        with self._lock:
+            if tab not in self._worksheets:
+                try:
+                    ws = self.request(sh.worksheet, tab)
+                except gspread.exceptions.WorksheetNotFound:
+                    layout = TAB_LAYOUTS[tab]
+                    ws = self.request(sh.add_worksheet, title=tab, rows=layout["rows"], cols=layout["cols"])
+                    self.request(ws.append_row, layout["header"])
+                self._worksheets[tab] = ws
+            return self._worksheets[tab]
+
+    # -- reads --
+    def fetch_tabs(self, tabs):
+        """Read several tabs in one values_batch_get request; returns {tab: DataFrame}.
+
+        Sheet1 comes back as a LedgerSnapshot: only rows appended since the last
+        read are requested, with a full reload when that delta doesn't line up.
+        """
+        import gspread
+
+        sync = self.ledger_sync
+        start_row = sync.start_row() if SHEET_TAB in tabs else None
+        ranges = {tab: _tab_range(tab, start_row) for tab in tabs}
+        try:
+            response = self.request(
+                self.get_spreadsheet().values_batch_get,
+                [f"'{tab}'!{a1}" if a1 else f"'{tab}'" for tab, a1 in ranges.items()], params=READ_PARAMS)
+            values = [value_range.get("values", []) for value_range in response["valueRanges"]]
+        except gspread.exceptions.APIError as e:
+            # Quota and server errors already went through the governor's retries; more requests won't help.
+            if is_transient(e):
+                raise
+            # e.g. a tab doesn't exist yet; get_worksheet creates it, then read the tabs side by side.
+            sheets = {tab: self.get_worksheet(tab) for tab in tabs}
+            with ThreadPoolExecutor(max_workers=len(tabs)) as pool:
+                values = list(pool.map(
+                    lambda tab: self.request(sheets[tab].get, ranges[tab], value_render_option="UNFORMATTED_VALUE",
+                                             date_time_render_option="FORMATTED_STRING"),
+                    tabs,
+                ))
+        frames = {}
+        for tab, tab_values in zip(tabs, values):
+            if tab == SHEET_TAB:
+                snapshot = sync.apply(start_row, tab_values)
+                if snapshot is None:
+                    full = self.request(
+                        self.get_worksheet(SHEET_TAB).get, _tab_range(SHEET_TAB), value_render_option="UNFORMATTED_VALUE",
+                        date_time_render_option="FORMATTED_STRING")
+                    snapshot = sync.apply(None, full)
+                frames[tab] = snapshot
+            else:
+                frames[tab] = _values_to_frame(tab_values)
+        return frames
+
+    def read_tabs(self, tabs, fresh=False):
+        return self.cache.get_many(tabs, self.fetch_tabs, fresh=fresh)
+
+    def read_tab(self, tab, fresh=False):
+        return self.read_tabs([tab], fresh=fresh)[tab]
+
+    def prefetch(self, tabs):
+        """Warm the cache for every tab a page is about to read, in one request."""
+        self.read_tabs(tabs)
+
+    def load_ledger(self, fresh=False):
+        """Current LedgerSnapshot; its frame is shared between sessions, so don't modify it in place."""
+        snapshot = self.read_tab(SHEET_TAB, fresh=fresh)
+        if (snapshot.frame["ID"].str.strip() == "").any():
+            self.ensure_ids(SHEET_TAB)
+            return self.load_ledger(fresh=True)
+        return snapshot
+
+    def load_targets_frame(self):
+        return self.read_tab(TARGETS_TAB)
+
+    def load_admin_logs_frame(self, n):
+        """The last ``n`` log entries (all of them for None), oldest first."""
+        logs = self.read_tab(ADMIN_LOGS_TAB).dropna(how='all').fillna("")
+        return logs if n is None else logs.tail(n)
+
+    def load_history_frame(self):
+        return self.read_tab(HISTORY_TAB)
+
+    def load_pending_dupes_frame(self, fresh=False):
+        pending = _parse_pending(self.read_tab(PENDING_DUPES_TAB, fresh=fresh))
+        if (pending["ID"].str.strip() == "").any():
+            self.ensure_ids(PENDING_DUPES_TAB)
+            return self.load_pending_dupes_frame(fresh=True)
+        return pending
+
+    # -- deposits --
+    def _ledger_changed(self, rows_removed=False):
+        if rows_removed:
+            self.ledger_sync.reset()
+        self.cache.invalidate(SHEET_TAB)
+
+    def ensure_ids(self, tab):
+        # One-off migration for rows written before deposits (SHEET_TAB) or pending duplicates carried an ID.
+        ws = self.get_worksheet(tab)
+        if ws.col_count < 4:
+            self.request(ws.add_cols, 4 - ws.col_count)
+        values = self.request(ws.get_all_values)
+        updates = []
+        if not values or len(values[0]) < 4 or values[0][3] != "ID":
+            updates.append({"range": "D1", "values": [["ID"]]})
+        for row_number, row in enumerate(values[1:], start=2):
+            has_row = any(cell for cell in row[:3])
+            if has_row and (len(row) < 4 or not row[3].strip()):
+                updates.append({"range": f"D{row_number}", "values": [[new_deposit_id()]]})
+        if updates:
+            self.request(ws.batch_update, updates)
+        if tab == SHEET_TAB:
+            self._ledger_changed(rows_removed=True)
+        else:
+            self.cache.invalidate(tab)
+
+    def _row_numbers(self, ws, ids):
+        # Look rows up by their ID (column D) right before writing, so shifted rows can't be hit by mistake.
+        wanted = set(ids)
+        return {value: row_number for row_number, value in enumerate(self.request(ws.col_values, 4), start=1)
+                if row_number > 1 and value in wanted}
+
+    def _append_rows(self, ws, rows, table_range=None):
+        # INSERT_ROWS: the API appends after the table it finds, which ends at the first blank row; the
+        # default (OVERWRITE) would then write over whatever follows that gap instead of pushing it down.
+        return self.request(ws.append_rows, rows, value_input_option="RAW", insert_data_option="INSERT_ROWS",
+                            table_range=table_range)
+
+    def _delete_rows(self, ws, row_numbers):
+        # All in one request, bottom-up, so earlier deletes don't shift the rows still to be deleted.
+        requests = [{"deleteDimension": {"range": {
+            "sheetId": ws.id, "dimension": "ROWS", "startIndex": row_number - 1, "endIndex": row_number,
+        }}} for row_number in sorted(row_numbers, reverse=True)]
+        self.request(self.get_spreadsheet().batch_update, {"requests": requests})
+
+    def append_deposits(self, rows):
+        """Append new deposits in a single request; returns the rows with their IDs."""
+        records = _deposit_records(rows)
+        if records:
+            ws = self.get_worksheet(SHEET_TAB)
+            self._append_rows(ws, [[r[col] for col in DEPOSIT_COLUMNS] for r in records])
+            self._ledger_changed()
+        return records
+
+    def commit_deposits(self, rows):
+        """Append the rows that don't duplicate a ledger deposit; returns (added, duplicates).
+
+        The ledger revision (its ID column) is checked right before appending and
+        the commit retried if another admin wrote in between. Once appended, any
+        of our rows that lost a race to an identical deposit written just before
+        them are withdrawn again and reported as duplicates, so two admins
+        entering the same hand-in never double-book it.
+        """
+        ws = self.get_worksheet(SHEET_TAB)
+        for attempt in range(DEPOSIT_COMMIT_ATTEMPTS):
+            df = self.load_ledger(fresh=True).frame
+            new_rows, duplicates = DepositIndex(df).partition(rows)
+            if not new_rows:
+                return [], duplicates
+            # Blank rows read as "" here but are dropped from the ledger, so compare non-blank IDs only.
+            ids = [value.strip() for value in self.request(ws.col_values, 4)[1:] if value.strip()]
+            if ids != df["ID"].str.strip().tolist():
+                time.sleep(0.5 * (attempt + 1))
+                continue
+            added = self.append_deposits(new_rows)
+
+            df = self.load_ledger(fresh=True).frame
+            # Ours survive only where they are the first ledger row with their key.
+            first_ids = set(df.drop_duplicates(["UserKey", "Item", "Quantity"])["ID"])
+            lost = [r for r in added if r["ID"] not in first_ids]
+            if lost:
+                self.delete_deposits([r["ID"] for r in lost])
+                added = [r for r in added if r not in lost]
+            return added, duplicates + lost
+        raise ConcurrentDepositError("The ledger kept changing while saving; please submit again.")
+
+    def confirm_deposits(self, rows):
+        """Add confirmed pending offers under their own IDs; returns (added, existing).
+
+        Offers whose ID is already in the ledger are not added again. Two admins
+        confirming the same offer at once can both get past that check, so once
+        appended, each of our rows that an earlier row with the same ID beat is
+        withdrawn again and reported as existing, as commit_deposits does.
+        """
+        import gspread
+        records = _deposit_records(rows)
+        seen = set(self.load_ledger(fresh=True).frame["ID"])
+        new_records = []
+        for record in records:
+            if record["ID"] not in seen:
+                seen.add(record["ID"])
+                new_records.append(record)
+        if not new_records:
+            return [], records
+        ws = self.get_worksheet(SHEET_TAB)
+        response = self._append_rows(ws, [[r[col] for col in DEPOSIT_COLUMNS] for r in new_records])
+        self._ledger_changed()
+
+        # The append reports where our rows went; each must still be the first row with its ID.
+        first_row = gspread.utils.a1_to_rowcol(response["updates"]["updatedRange"].split("!")[-1].split(":")[0])[0]
+        ids = [value.strip() for value in self.request(ws.col_values, 4)]
+        first_rows = {}
+        for row_number, value in enumerate(ids[1:], start=2):
+            first_rows.setdefault(value, row_number)
+        lost_rows = {}
+        for row_number, record in enumerate(new_records, start=first_row):
+            # Only a row that still holds our ID is ours to delete; a shifted one is left alone.
+            if first_rows.get(record["ID"]) != row_number and ids[row_number - 1:row_number] == [record["ID"]]:
+                lost_rows[row_number] = record["ID"]
+        if lost_rows:
+            self._delete_rows(ws, list(lost_rows))
+            self._ledger_changed(rows_removed=True)
+        added = [r for r in new_records if r["ID"] not in lost_rows.values()]
+        return added, [r for r in records if r not in added]
+
+    def update_deposit(self, deposit_id, user, item, quantity):
+        ws = self.get_worksheet(SHEET_TAB)
+        row_number = self._row_numbers(ws, [deposit_id]).get(deposit_id)
+        if row_number is None:
+            return False
+        self.request(ws.update, range_name=f"A{row_number}:C{row_number}", values=[[user, item, int(quantity)]],
+                     value_input_option="RAW")
+        self._ledger_changed(rows_removed=True)
+        return True
+
+    def delete_deposits(self, deposit_ids):
+        """Delete deposits by ID in one batched request; returns how many rows were removed."""
+        ws = self.get_worksheet(SHEET_TAB)
+        row_numbers = list(self._row_numbers(ws, deposit_ids).values())
+        if row_numbers:
+            self._delete_rows(ws, row_numbers)
+            self._ledger_changed(rows_removed=True)
+        return len(row_numbers)
+
+    # -- targets, logs, pending duplicates --
+    def update_targets(self, cells):
+        """Write ``cells`` of [Item, column, value] into the Targets tab with one batch_update.
+
+        Each item keeps its row; items without one get a new row below the
+        last. Nothing else in the tab is touched, so readers never see it
+        half-written and concurrent edits to other items survive.
+        """
+        if not cells:
+            return
+        ws = self.get_worksheet(TARGETS_TAB)
+        current = self.read_tab(TARGETS_TAB, fresh=True)
+        data = []
+        item_rows = {}
+        if "Item" in current.columns:
+            # Sheet row of each item; a repeated item resolves to its last row, as in parse_targets().
+            item_rows = {item: position + 2 for position, item in enumerate(current["Item"]) if isinstance(item, str)}
+        else:
+            data.append({"range": "A1", "values": [TARGET_COLUMNS]})
+        next_row = len(current) + 2
+        for item, column, value in cells:
+            if item not in item_rows:
+                item_rows[item] = next_row
+                next_row += 1
+                data.append({"range": f"A{item_rows[item]}", "values": [[item]]})
+            column_letter = chr(ord("A") + TARGET_COLUMNS.index(column))
+            data.append({"range": f"{column_letter}{item_rows[item]}", "values": [[value]]})
+        if next_row - 1 > ws.row_count:
+            self.request(ws.add_rows, next_row - 1 - ws.row_count)
+        self.request(ws.batch_update, data, value_input_option="RAW")
+        self.cache.invalidate(TARGETS_TAB)
+
+    def append_admin_logs(self, rows):
+        self._append_rows(self.get_worksheet(ADMIN_LOGS_TAB), rows)
+        self.cache.invalidate(ADMIN_LOGS_TAB)
+
+    def append_pending_dupes(self, rows):
+        """Append suspected duplicates in one request; returns them with their IDs."""
+        records = _deposit_records(rows)
+        if records:
+            self._append_rows(self.get_worksheet(PENDING_DUPES_TAB),
+                              [[r[col] for col in PENDING_DUPE_COLUMNS] for r in records])
+            self.cache.invalidate(PENDING_DUPES_TAB)
+        return records
+
+    def remove_pending_dupes(self, dupe_ids):
+        """Remove pending duplicates by ID in one batched request; returns how many rows were removed."""
+        ws = self.get_worksheet(PENDING_DUPES_TAB)
+        row_numbers = list(self._row_numbers(ws, dupe_ids).values())
+        if row_numbers:
+            self._delete_rows(ws, row_numbers)
+            self.cache.invalidate(PENDING_DUPES_TAB)
+        return len(row_numbers)
+
+    def append_history(self, rows):
+        self._append_rows(self.get_worksheet(HISTORY_TAB), rows)
+        self.cache.invalidate(HISTORY_TAB)
+
+    def replace_history(self, rows):
+        """Rewrite the History tab with ``rows`` (after compaction).
+
+        The new rows are appended before the old ones go in one delete, so a
+        failure in between never leaves the tab empty. They go right below the
+        last used row, so even a tab with gaps ends up with exactly the new rows.
+        """
+        ws = self.get_worksheet(HISTORY_TAB)
+        used_rows = len(self.request(ws.col_values, 1))
+        if rows:
+            self._append_rows(ws, rows, table_range=f"A{used_rows + 1}")
+        if used_rows > 1:
+            self.request(self.get_spreadsheet().batch_update, {"requests": [{"deleteDimension": {"range": {
+                "sheetId": ws.id, "dimension": "ROWS", "startIndex": 1, "endIndex": used_rows,
+            }}}]})
+        self.cache.invalidate(HISTORY_TAB)
+
+
+# ---- SQLITE ----
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deposits (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user TEXT NOT NULL,
+    user_norm TEXT NOT NULL,
+    item TEXT NOT NULL,
+    quantity INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deposits_item ON deposits (item);
+CREATE INDEX IF NOT EXISTS deposits_user ON deposits (user_norm, item, quantity);
+CREATE TABLE IF NOT EXISTS targets (item TEXT PRIMARY KEY, target TEXT, divines TEXT);
+CREATE TABLE IF NOT EXISTS admin_logs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT, admin_user TEXT, action TEXT, details TEXT
+);
+CREATE TABLE IF NOT EXISTS pending_dupes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT, item TEXT, quantity INTEGER, id TEXT
+);
+CREATE TABLE IF NOT EXISTS history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT, item TEXT, total INTEGER, value INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL, args TEXT NOT NULL, error TEXT
+);
+"""
+# Targets tab column -> targets table column.
+TARGET_FIELDS = {"Target": "target", "Divines": "divines"}
+
+
+class SQLiteStorage:
+    """Local store with the same tables as the spreadsheet, indexed on item and user.
+
+    With ``read_only`` an existing database is opened for reading only;
+    a missing one raises sqlite3.OperationalError instead of being created.
+    With ``outbox`` set (MirroredStorage does), every write also queues
+    itself in the outbox table, in the same transaction, for SheetsMirror.
+    """
+
+    def __init__(self, path, read_only=False):
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self.outbox = False
+        if read_only:
+            uri = Path(path).resolve().as_uri() + "?mode=ro"
+            self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+            return
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # Databases created before pending duplicates carried an ID. The IDs given here are only
+        # placeholders: the PendingDupes tab never sees them, so open_storage reloads the rows,
+        # with the IDs Sheets gives them, as soon as it can (see pending_ids_stale).
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(pending_dupes)")}
+        if "id" not in columns:
+            def add_ids(conn):
+                conn.execute("ALTER TABLE pending_dupes ADD COLUMN id TEXT")
+                seqs = [row[0] for row in conn.execute("SELECT seq FROM pending_dupes")]
+                conn.executemany("UPDATE pending_dupes SET id = ? WHERE seq = ?", [(new_deposit_id(), seq) for seq in seqs])
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('pending_ids_stale', 1)")
+            self._write(add_ids)
+
+    def pending_ids_stale(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta WHERE key = 'pending_ids_stale'").fetchone() is not None
+
+    def reload_pending_dupes(self, source):
+        """Replace the pending duplicates with another backend's, IDs included; nothing is queued."""
+        pending = source.load_pending_dupes_frame(fresh=True)
+
+        def reload(conn):
+            conn.execute("DELETE FROM pending_dupes")
+            self._insert_pending(conn, _deposit_records(pending.to_dict("records")))
+            conn.execute("DELETE FROM meta WHERE key = 'pending_ids_stale'")
+        self._write(reload)
+
+    def _write(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _query(self, sql, params=(), columns=None):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return pd.DataFrame(rows, columns=columns)
+
+    def _ledger_version(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'ledger_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def _queue(self, conn, op, *args):
+        if self.outbox:
+            conn.execute("INSERT INTO outbox (op, args) VALUES (?, ?)", (op, json.dumps(args, default=_json_scalar)))
+
+    def outbox_entries(self):
+        """Queued writes still to be mirrored, as (seq, op, args), oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, op, args FROM outbox WHERE error IS NULL ORDER BY seq").fetchall()
+        return [(seq, op, json.loads(args)) for seq, op, args in rows]
+
+    def outbox_pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE error IS NULL").fetchone()[0]
+
+    def outbox_failures(self):
+        """Writes the mirror gave up on, as (op, args, error), oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT op, args, error FROM outbox WHERE error IS NOT NULL ORDER BY seq").fetchall()
+        return [(op, json.loads(args), error) for op, args, error in rows]
+
+    def outbox_done(self, seqs):
+        self._write(lambda conn: conn.executemany("DELETE FROM outbox WHERE seq = ?", [(seq,) for seq in seqs]))
+
+    def outbox_failed(self, seqs, error):
+        self._write(lambda conn: conn.executemany("UPDATE outbox SET error = ? WHERE seq = ?",
+                                                  [(error, seq) for seq in seqs]))
+
+    @staticmethod
+    def _bump_ledger_version(conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('ledger_version', 1) "
+                     "ON CONFLICT (key) DO UPDATE SET value = value + 1")
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM meta WHERE key = 'hydrated'").fetchone() is None
+
+    def hydrate_from(self, source):
+        """Copy every tab from another backend into this (new) database."""
+        source.prefetch([SHEET_TAB, TARGETS_TAB, ADMIN_LOGS_TAB, PENDING_DUPES_TAB, HISTORY_TAB])
+        ledger = source.load_ledger().frame
+        targets = source.load_targets_frame().dropna(how='all').fillna("")
+        logs = source.load_admin_logs_frame(n=None)
+        pending = source.load_pending_dupes_frame()
+        history = source.load_history_frame().dropna(how='all').fillna("")
+
+        def copy(conn):
+            self._insert_deposits(conn, ledger.to_dict("records"))
+            conn.executemany("INSERT OR REPLACE INTO targets VALUES (?, ?, ?)",
+                             [[str(row.get(col, "")) for col in TARGET_COLUMNS] for row in targets.to_dict("records")])
+            conn.executemany("INSERT INTO admin_logs (timestamp, admin_user, action, details) VALUES (?, ?, ?, ?)",
+                             [[str(row.get(col, "")) for col in ADMIN_LOG_COLUMNS] for row in logs.to_dict("records")])
+            self._insert_pending(conn, _deposit_records(pending.to_dict("records")))
+            self._insert_history(conn, [[row.get(col, "") for col in HISTORY_COLUMNS] for row in history.to_dict("records")])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('hydrated', ?)", (time.time(),))
+        self._write(copy)
+
+    def prefetch(self, tabs):
+        pass
+
+    def load_ledger(self, fresh=False):
+        version = self._ledger_version()
+        if self._snapshot is None or self._snapshot.version != version:
+            frame = self._query("SELECT user, item, quantity, id FROM deposits ORDER BY seq",
+                                columns=DEPOSIT_COLUMNS)
+            self._snapshot = _snapshot(compact_ledger(frame), version)
+        return self._snapshot
+
+    def load_targets_frame(self):
+        return self._query("SELECT item, target, divines FROM targets", columns=TARGET_COLUMNS)
+
+    def load_admin_logs_frame(self, n):
+        sql = "SELECT timestamp, admin_user, action, details FROM admin_logs ORDER BY seq DESC"
+        params = ()
+        if n is not None:
+            sql += " LIMIT ?"
+            params = (n,)
+        return self._query(sql, params, columns=ADMIN_LOG_COLUMNS).iloc[::-1].reset_index(drop=True)
+
+    def load_history_frame(self):
+        return self._query("SELECT timestamp, item, total, value FROM history ORDER BY seq", columns=HISTORY_COLUMNS)
+
+    def load_pending_dupes_frame(self):
+        df = self._query("SELECT user, item, quantity, id FROM pending_dupes ORDER BY seq",
+                         columns=PENDING_DUPE_COLUMNS)
+        df["Quantity"] = df["Quantity"].astype(int)
+        return df
+
+    def _insert_deposits(self, conn, records):
+        conn.executemany(
+            "INSERT INTO deposits (id, user, user_norm, item, quantity) VALUES (?, ?, ?, ?, ?)",
+            [(r["ID"], r["User"], normalize_user(r["User"]), r["Item"], int(r["Quantity"])) for r in records])
+        self._bump_ledger_version(conn)
+
+    def append_deposits(self, rows):
+        records = _deposit_records(rows)
+        if records:
+            def append(conn):
+                self._insert_deposits(conn, records)
+                self._queue(conn, "append_deposits", records)
+            self._write(append)
+        return records
+
+    def commit_deposits(self, rows):
+        """Insert the rows that don't duplicate a ledger deposit; returns (added, duplicates).
+
+        Duplicates are found with the same DepositIndex the Sheets backend uses,
+        built from the ledger as read inside the write transaction, so
+        concurrent commits are serialized and can't double-book a deposit.
+        """
+        def commit(conn):
+            added, duplicates = DepositIndex(self.load_ledger().frame).partition(rows)
+            added = _deposit_records(added)
+            if added:
+                self._insert_deposits(conn, added)
+                self._queue(conn, "append_deposits", added)
+            return added, duplicates
+        return self._write(commit)
+
+    def confirm_deposits(self, rows):
+        """Insert confirmed pending offers under their own IDs; returns (added, existing).
+
+        The ID is unique, so an offer that is already in the ledger is skipped
+        by the insert itself and only the rows actually inserted are reported.
+        """
+        records = _deposit_records(rows)
+
+        def confirm(conn):
+            added = [r for r in records if conn.execute(
+                "INSERT OR IGNORE INTO deposits (id, user, user_norm, item, quantity) VALUES (?, ?, ?, ?, ?)",
+                (r["ID"], r["User"], normalize_user(r["User"]), r["Item"], int(r["Quantity"]))).rowcount]
+            if added:
+                self._bump_ledger_version(conn)
+                self._queue(conn, "append_deposits", added)
+            return added, [r for r in records if r not in added]
+        return self._write(confirm)
+
+    def update_deposit(self, deposit_id, user, item, quantity):
+        def update(conn):
+            cursor = conn.execute(
+                "UPDATE deposits SET user = ?, user_norm = ?, item = ?, quantity = ? WHERE id = ?",
+                (user, normalize_user(user), item, int(quantity), deposit_id))
+            self._bump_ledger_version(conn)
+            if cursor.rowcount:
+                self._queue(conn, "update_deposit", deposit_id, user, item, int(quantity))
+            return cursor.rowcount > 0
+        return self._write(update)
+
+    def delete_deposits(self, deposit_ids):
+        def delete(conn):
+            cursor = conn.executemany("DELETE FROM deposits WHERE id = ?", [(i,) for i in deposit_ids])
+            self._bump_ledger_version(conn)
+            if cursor.rowcount:
+                self._queue(conn, "delete_deposits", list(deposit_ids))
+            return cursor.rowcount
+        return self._write(delete)
+
+    def update_targets(self, cells):
+        def update(conn):
+            for item, column, value in cells:
+                field = TARGET_FIELDS[column]
+                conn.execute(f"INSERT INTO targets (item, {field}) VALUES (?, ?) "
+                             f"ON CONFLICT(item) DO UPDATE SET {field} = excluded.{field}", (item, str(value)))
+            self._queue(conn, "update_targets", cells)
+        self._write(update)
+
+    def append_admin_logs(self, rows):
+        def append(conn):
+            conn.executemany("INSERT INTO admin_logs (timestamp, admin_user, action, details) VALUES (?, ?, ?, ?)", rows)
+            self._queue(conn, "append_admin_logs", rows)
+        self._write(append)
+
+    @staticmethod
+    def _insert_pending(conn, records):
+        conn.executemany("INSERT INTO pending_dupes (user, item, quantity, id) VALUES (?, ?, ?, ?)",
+                         [(r["User"], r["Item"], int(r["Quantity"]), r["ID"]) for r in records])
+
+    def append_pending_dupes(self, rows):
+        records = _deposit_records(rows)
+        if records:
+            def append(conn):
+                self._insert_pending(conn, records)
+                self._queue(conn, "append_pending_dupes", records)
+            self._write(append)
+        return records
+
+    def remove_pending_dupes(self, dupe_ids):
+        dupe_ids = list(dupe_ids)
+        if not dupe_ids:
+            return 0
+        placeholders = ", ".join("?" * len(dupe_ids))
+
+        def remove(conn):
+            removed = conn.execute(f"DELETE FROM pending_dupes WHERE id IN ({placeholders})", dupe_ids).rowcount
+            if removed:
+                self._queue(conn, "remove_pending_dupes", dupe_ids)
+            return removed
+        return self._write(remove)
+
+    @staticmethod
+    def _insert_history(conn, rows):
+        conn.executemany("INSERT INTO history (timestamp, item, total, value) VALUES (?, ?, ?, ?)", rows)
+
+    def append_history(self, rows):
+        def append(conn):
+            self._insert_history(conn, rows)
+            self._queue(conn, "append_history", rows)
+        self._write(append)
+
+    def replace_history(self, rows):
+        def replace(conn):
+            conn.execute("DELETE FROM history")
+            self._insert_history(conn, rows)
+            self._queue(conn, "replace_history", rows)
+        self._write(replace)
+
+
+# ---- WRITE-BEHIND MIRROR ----
+# Writes whose argument lists can be merged when they queue up back to back.
+MERGEABLE_OPS = {
+    "append_deposits", "delete_deposits", "update_targets", "append_admin_logs", "append_pending_dupes",
+    "remove_pending_dupes", "append_history",
+}
+
+
+class SheetsMirror:
+    """Background worker replaying the local outbox onto the spreadsheet in order.
+
+    Every local change is queued in the SQLite outbox table by the same
+    transaction that makes it, and an entry is only deleted once Sheets
+    accepted it, so a crash or restart never loses a change: whatever is
+    left is replayed first when the worker starts. Changes queued within
+    MIRROR_BATCH_SECONDS of each other are sent together, with back-to-back
+    appends/deletes merged into one request. A write failing for a transient
+    reason (outage, quota) is retried with backoff until it goes through, so
+    later writes never overtake it; any other failure is logged and set aside
+    in failures() so it can't hold up the queue.
+    """
+
+    def __init__(self, local, sheets):
+        self.local = local
+        self.sheets = sheets
+        self._wake = threading.Event()
+        self._wake.set()
+        self._drained = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="sheets-mirror", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush, 10)
+
+    def notify(self):
+        """Tell the worker the outbox has new entries."""
+        self._wake.set()
+
+    def pending(self):
+        return self.local.outbox_pending()
+
+    def failures(self):
+        """Writes given up on, as (op, argument, error), oldest first."""
+        return [(op, args[0] if len(args) == 1 else tuple(args), error)
+                for op, args, error in self.local.outbox_failures()]
+
+    def flush(self, timeout=None):
+        """Wait until every queued write reached the spreadsheet; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._drained:
+            while self.pending():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._drained.wait(0.5 if remaining is None else min(remaining, 0.5))
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(MIRROR_BATCH_SECONDS)
+            self._wake.clear()
+            for op, args, seqs in self._merge(self.local.outbox_entries()):
+                self._apply(op, args, seqs)
+            with self._drained:
+                self._drained.notify_all()
+
+    @staticmethod
+    def _merge(entries):
+        merged = []
+        for seq, op, args in entries:
+            if merged and op in MERGEABLE_OPS and merged[-1][0] == op:
+                merged[-1][1][0].extend(args[0])
+                merged[-1][2].append(seq)
+            else:
+                merged.append((op, args, [seq]))
+        return merged
+
+    def _apply(self, op, args, seqs):
+        attempt = 0
+        while True:
+            try:
+                getattr(self.sheets, op)(*args)
+            except Exception as e:
+                if not is_transient(e):
+                    logger.exception("Mirroring %s to Google Sheets failed; skipping it", op)
+                    self.local.outbox_failed(seqs, str(e))
+                    return
+                logger.exception("Mirroring %s to Google Sheets failed (attempt %d)", op, attempt + 1)
+                time.sleep(min(60, 2 ** attempt))
+                attempt += 1
+            else:
+                self.local.outbox_done(seqs)
+                return
+
+
+class MirroredStorage:
+    """SQLite as the primary store, with every change mirrored to Google Sheets through its outbox."""
+
+    def __init__(self, local, sheets):
+        self.local = local
+        self.sheets = sheets
+        local.outbox = True
+        self.mirror = SheetsMirror(local, sheets)
+
+    def _written(self, result):
+        self.mirror.notify()
+        return result
+
+    def prefetch(self, tabs):
+        pass
+
+    def load_ledger(self, fresh=False):
+        return self.local.load_ledger(fresh)
+
+    def load_targets_frame(self):
+        return self.local.load_targets_frame()
+
+    def load_admin_logs_frame(self, n):
+        return self.local.load_admin_logs_frame(n)
+
+    def load_pending_dupes_frame(self):
+        return self.local.load_pending_dupes_frame()
+
+    def load_history_frame(self):
+        return self.local.load_history_frame()
+
+    def append_deposits(self, rows):
+        return self._written(self.local.append_deposits(rows))
+
+    def commit_deposits(self, rows):
+        return self._written(self.local.commit_deposits(rows))
+
+    def confirm_deposits(self, rows):
+        return self._written(self.local.confirm_deposits(rows))
+
+    def update_deposit(self, deposit_id, user, item, quantity):
+        return self._written(self.local.update_deposit(deposit_id, user, item, quantity))
+
+    def delete_deposits(self, deposit_ids):
+        return self._written(self.local.delete_deposits(deposit_ids))
+
+    def update_targets(self, cells):
+        return self._written(self.local.update_targets(cells))
+
+    def append_admin_logs(self, rows):
+        return self._written(self.local.append_admin_logs(rows))
+
+    def append_pending_dupes(self, rows):
+        return self._written(self.local.append_pending_dupes(rows))
+
+    def remove_pending_dupes(self, dupe_ids):
+        return self._written(self.local.remove_pending_dupes(dupe_ids))
+
+    def append_history(self, rows):
+        return self._written(self.local.append_history(rows))
+
+    def replace_history(self, rows):
+        return self._written(self.local.replace_history(rows))
+
+
+def open_storage(credentials_info, backend=STORAGE_BACKEND, sqlite_path=SQLITE_PATH):
+    """Build the configured backend; a new SQLite database is first filled from the spreadsheet."""
+    sheets = SheetsStorage(credentials_info)
+    if backend == "sheets":
+        return sheets
+    local = SQLiteStorage(sqlite_path)
+    if local.is_empty():
+        local.hydrate_from(sheets)
+    storage = MirroredStorage(local, sheets)
+    # Changes a previous run queued but never got to Sheets go out before this one serves anything.
+    if not storage.mirror.flush(MIRROR_REPLAY_SECONDS):
+        logger.warning("%d change(s) from a previous run are still waiting to reach Google Sheets",
+                       storage.mirror.pending())
+    elif local.pending_ids_stale():
+        # Sheets now has every queued change, so its pending duplicates (given IDs on the way) are the full set.
+        local.reload_pending_dupes(sheets)
+    return storage
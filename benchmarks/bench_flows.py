@@ -0,0 +1,156 @@
+"""Time the app's main flows offline, against the in-memory Sheets stand-in.
+
+Runs bank_app.py under Streamlit's AppTest with gspread pointed at a
+FakeSpreadsheet (tests/fake_sheets.py) seeded with N deposits, and reports
+wall time and Sheets requests for each flow: viewer render (cold and warm), admin
+render, deposit, duplicate deposit, confirm duplicate and bulk delete.
+``--latency`` adds a simulated round trip to every request, and the quota
+governor only throttles at Google's per-minute limits with ``--quota``
+(otherwise bursts of requests would mostly time its token buckets). With
+``--backend sqlite`` the Sheets writes happen on the mirror thread; each
+flow waits for the mirror to catch up before its requests are counted, but
+that wait is not part of its time.
+
+    python benchmarks/bench_flows.py [--sizes 1000 10000] [--latency 0.05] [--quota] [--backend sheets]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bank_core import ALL_ITEMS, DEPOSIT_COLUMNS  # noqa: E402
+from tests.fake_sheets import FakeSpreadsheet, install  # noqa: E402
+
+APP = os.path.join(ROOT, "bank_app.py")
+BENCH_USER = "bench_user"
+
+
+def seed(sheets, n_rows, n_users=500, seed=0):
+    rng = np.random.default_rng(seed)
+    users = rng.integers(0, n_users, n_rows)
+    items = rng.integers(0, len(ALL_ITEMS), n_rows)
+    quantities = rng.integers(1, 50, n_rows)
+    sheets.add_tab("Sheet1", [DEPOSIT_COLUMNS] + [
+        [f"user{u}", ALL_ITEMS[i], str(q), uuid.uuid4().hex[:12]]
+        for u, i, q in zip(users.tolist(), items.tolist(), quantities.tolist())])
+    sheets.add_tab("Targets", [["Item", "Target", "Divines"]])
+    sheets.add_tab("AdminLogs", [["Timestamp", "AdminUser", "AdminAction", "Details"]])
+    sheets.add_tab("PendingDupes", [["User", "Item", "Quantity", "ID"]])
+    sheets.add_tab("History", [["Timestamp", "Item", "Total", "Value"]])
+
+
+def deposit(at, quantity):
+    at.text_input[0].input(BENCH_USER)
+    at.number_input(key=f"add_{ALL_ITEMS[0]}").set_value(quantity)
+    next(b for b in at.button if b.label == "Add Deposit(s)").click()
+
+
+def tick_and_click(at, grid_prefix, column, count, button_key):
+    # Tick the first ``count`` rows of a data_editor grid, then press the button acting on them.
+    grid_key = next(k for k in at.session_state if str(k).startswith(grid_prefix))
+    selection = {"edited_rows": {i: {column: True} for i in range(count)}, "added_rows": [], "deleted_rows": []}
+    at.session_state[grid_key] = selection
+    at.run()
+    at.button(key=button_key).click()
+    # A click rerun starts without the editor's edits; hand them over again.
+    at.session_state[grid_key] = selection
+
+
+def run_flows(n_rows, latency, delete_count):
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+
+    import bank_storage
+    from bank_quota import PROCESS_METRICS
+
+    sheets = FakeSpreadsheet()
+    seed(sheets, n_rows)
+    sheets.latency = latency
+    install(sheets)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+    # Keep hold of the storage the app opens, to flush its Sheets mirror (sqlite backend).
+    opened = []
+    open_storage = bank_storage.open_storage
+
+    def recording_open_storage(*args, **kwargs):
+        opened.append(open_storage(*args, **kwargs))
+        return opened[-1]
+
+    at = AppTest.from_file(APP, default_timeout=600)
+    at.secrets["gcp_service_account"] = {}
+
+    def admin():
+        at.session_state["is_editor"] = True
+        at.session_state["admin_user"] = "bench"
+
+    flows = [
+        ("viewer render (cold)", lambda: None),
+        ("viewer render (warm)", lambda: None),
+        ("admin render", admin),
+        ("deposit", lambda: deposit(at, 7)),
+        ("duplicate deposit", lambda: deposit(at, 7)),
+        ("confirm duplicate", lambda: tick_and_click(at, "pending_grid_", "Select", 1, "confirm_selected")),
+        (f"delete {delete_count} rows", lambda: tick_and_click(at, "delete_grid_", "Delete", delete_count,
+                                                               "delete_selected")),
+    ]
+    results = []
+    bank_storage.open_storage = recording_open_storage
+    try:
+        for name, action in flows:
+            action()
+            sheets.calls.clear()
+            throttled = PROCESS_METRICS.throttled_seconds
+            start = time.perf_counter()
+            at.run()
+            elapsed = time.perf_counter() - start
+            if at.exception:
+                raise RuntimeError(f"{name}: {at.exception[0].value}")
+            for storage in opened:
+                if hasattr(storage, "mirror"):
+                    storage.mirror.flush()
+            results.append((name, elapsed, PROCESS_METRICS.throttled_seconds - throttled, dict(sheets.calls)))
+    finally:
+        bank_storage.open_storage = open_storage
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per Sheets request")
+    parser.add_argument("--quota", action="store_true", help="throttle at the default Sheets quota")
+    parser.add_argument("--backend", choices=["sheets", "sqlite"], default="sheets")
+    parser.add_argument("--delete", type=int, default=10, help="rows removed in the bulk delete flow")
+    args = parser.parse_args()
+
+    # bank_storage and bank_quota read these when they are first imported.
+    workdir = tempfile.mkdtemp(prefix="bank_bench_")
+    if not args.quota:
+        os.environ["BANK_SHEETS_READS_PER_MINUTE"] = os.environ["BANK_SHEETS_WRITES_PER_MINUTE"] = "1000000"
+    os.environ["BANK_STORAGE"] = args.backend
+    os.environ["BANK_SQLITE_PATH"] = os.path.join(workdir, "bank.sqlite3")
+    try:
+        for n_rows in args.sizes:
+            for name in os.listdir(workdir):
+                os.remove(os.path.join(workdir, name))
+            print(f"\n{n_rows} rows, {args.backend} backend, {args.latency * 1000:.0f} ms per request")
+            print(f"{'flow':>22} {'ms':>9} {'throttled':>10} {'requests':>9}  by method")
+            for name, elapsed, throttled, calls in run_flows(n_rows, args.latency, args.delete):
+                by_method = ", ".join(f"{method} x{count}" for method, count in sorted(calls.items()))
+                print(f"{name:>22} {elapsed * 1000:>9.1f} {throttled * 1000:>10.1f} {sum(calls.values()):>9}  {by_method}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
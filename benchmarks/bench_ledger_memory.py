@@ -0,0 +1,86 @@
+"""Compare memory and filter latency of the compact ledger with the old object-column frame.
+
+The old frame is what load_data used to return: User, Item and ID as Python
+strings and Quantity as int64. The compact one is bank_core.compact_ledger
+(categorical User/Item/UserKey, int32 Quantity). Both are timed on the
+lookups the app runs against the ledger.
+
+    python benchmarks/bench_ledger_memory.py [--sizes 100000 1000000]
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bank_core import ALL_ITEMS, DepositIndex, compact_ledger, ledger_totals  # noqa: E402
+
+
+def make_legacy_ledger(n_rows, n_users=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    users = np.array([f"User{i}" for i in range(n_users)], dtype=object)
+    return pd.DataFrame({
+        "User": users[rng.integers(0, n_users, n_rows)],
+        "Item": np.array(ALL_ITEMS, dtype=object)[rng.integers(0, len(ALL_ITEMS), n_rows)],
+        "Quantity": rng.integers(1, 50, n_rows),
+        "ID": np.array([uuid.uuid4().hex[:12] for _ in range(n_rows)], dtype=object),
+    }).astype({"User": object, "Item": object, "ID": object})
+
+
+def workloads(df):
+    item = ALL_ITEMS[3]
+    user = "user42"
+    user_keys = df["UserKey"] if "UserKey" in df.columns else None
+    return {
+        "item filter": lambda: df[df["Item"] == item],
+        "user filter": lambda: df[(user_keys if user_keys is not None
+                                   else df["User"].str.strip().str.lower()) == user],
+        "user search": lambda: df[df["User"].str.contains("ser12", case=False, regex=False)],
+        "ledger_totals": lambda: ledger_totals(df),
+        "DepositIndex": lambda: DepositIndex(df),
+    }
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def megabytes(df):
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for n_rows in args.sizes:
+        legacy = make_legacy_ledger(n_rows)
+        start = time.perf_counter()
+        compact = compact_ledger(legacy)
+        encode_ms = (time.perf_counter() - start) * 1000
+        assert ledger_totals(compact).sort_values(["Item", "User"]).reset_index(drop=True).equals(
+            ledger_totals(legacy).sort_values(["Item", "User"]).reset_index(drop=True))
+
+        print(f"\n{n_rows} rows: {megabytes(legacy):.1f} MB as objects, "
+              f"{megabytes(compact):.1f} MB compact (encoding took {encode_ms:.0f} ms)")
+        print(f"{'operation':>15} {'objects (ms)':>14} {'compact (ms)':>14}")
+        legacy_ops, compact_ops = workloads(legacy), workloads(compact)
+        for name in legacy_ops:
+            print(f"{name:>15} {timed(legacy_ops[name], args.repeat) * 1000:>14.1f} "
+                  f"{timed(compact_ops[name], args.repeat) * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Time the Deposits Overview aggregation on synthetic ledgers.
+
+Times what the page runs, bank_core.ledger_totals + item_summary and one
+item's user_breakdown (tables are only built for the items a viewer opens),
+against the per-item filter/groupby/iterrows loop the overview used to run,
+and shows how they scale up to 1M deposit rows.
+
+    python benchmarks/bench_overview.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bank_core import item_summary, ledger_totals, user_breakdown  # noqa: E402
+
+ITEMS = [f"Item {i}" for i in range(10)]
+TARGETS = {item: 100 + 50 * i for i, item in enumerate(ITEMS)}
+DIVINES = {item: 1.5 * (i + 1) for i, item in enumerate(ITEMS)}
+BANK_BUY_PCT = 80
+LEGACY_MAX_ROWS = 100_000   # the old loop gets very slow beyond this
+
+
+def make_ledger(n_rows, n_users=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "User": np.array([f"user{i}" for i in range(n_users)], dtype=object)[rng.integers(0, n_users, n_rows)],
+        "Item": np.array(ITEMS, dtype=object)[rng.integers(0, len(ITEMS), n_rows)],
+        "Quantity": rng.integers(1, 50, n_rows),
+    })
+
+
+def legacy_overview(df):
+    results = {}
+    for item in ITEMS:
+        total = df[(df["Item"] == item)]["Quantity"].sum()
+        item_df = df[df["Item"] == item]
+        target = TARGETS[item]
+        divine_val = DIVINES[item]
+        user_summary = (
+            item_df.groupby("User")["Quantity"]
+            .sum()
+            .sort_values(ascending=False)
+            .reset_index()
+        )
+        payouts = []
+        fees = []
+        for idx, row in user_summary.iterrows():
+            qty = row["Quantity"]
+            raw_payout = (qty / target) * divine_val if target else 0
+            fees.append(math.floor((raw_payout * 0.10) * 10) / 10)
+            payouts.append(math.floor((raw_payout - (raw_payout * 0.10)) * 10) / 10)
+        user_summary["Fee (10%)"] = fees
+        user_summary["Payout (Divines, after fee)"] = payouts
+        results[item] = (total, user_summary)
+    return results
+
+
+def overview(df):
+    totals = ledger_totals(df)
+    return totals, item_summary(totals, ITEMS, TARGETS, DIVINES, BANK_BUY_PCT)
+
+
+def check_same(df):
+    totals, summary = overview(df)
+    for item, (total, legacy_table) in legacy_overview(df).items():
+        assert summary.loc[item, "Total"] == total, item
+        ours = user_breakdown(totals, item, TARGETS, DIVINES).sort_values("User").reset_index(drop=True)
+        theirs = legacy_table.sort_values("User").reset_index(drop=True)
+        pd.testing.assert_frame_equal(ours, theirs[ours.columns], check_dtype=False)
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    check_same(make_ledger(5_000, n_users=300))
+    print(f"{'rows':>10} {'summary (ms)':>14} {'one table (ms)':>16} {'legacy loop (ms)':>18}")
+    for n_rows in args.sizes:
+        df = make_ledger(n_rows)
+        ours = timed(lambda: overview(df), args.repeat)
+        totals = ledger_totals(df)
+        table = timed(lambda: user_breakdown(totals, ITEMS[0], TARGETS, DIVINES), args.repeat)
+        legacy = "-"
+        if n_rows <= LEGACY_MAX_ROWS:
+            legacy = f"{timed(lambda: legacy_overview(df), 1) * 1000:.1f}"
+        print(f"{n_rows:>10} {ours * 1000:>14.1f} {table * 1000:>16.1f} {legacy:>18}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Time the integer settlement engine against the old float payout loop.
+
+bank_core.settle_tenths is timed next to the per-user math.floor loop the
+app used to run. Its results are checked against an exact Fraction
+reference, including the cases the float floor got wrong, and whole-bank
+settle_bank() runs for reconciliation in tests/test_settlement.py.
+
+    python benchmarks/bench_settlement.py [--sizes 10000 100000 1000000]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bank_core import settle_tenths  # noqa: E402
+
+LEGACY_MAX_ROWS = 100_000   # the old loop gets very slow beyond this
+
+
+def make_pairs(n_rows, seed=0):
+    """Random (item, user) totals with awkward targets and 0.01-step Divine values."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Quantity": rng.integers(1, 5000, n_rows),
+        "Target": rng.choice([0, 1, 3, 7, 30, 99, 100, 333, 1000], n_rows),
+        "Divines": rng.integers(0, 50_000, n_rows) / 100,
+    })
+
+
+def legacy_tenths(qty, target, divine_val):
+    raw_payout = (qty / target) * divine_val if target else 0
+    fee = math.floor((raw_payout * 0.10) * 10) / 10
+    payout = math.floor((raw_payout - (raw_payout * 0.10)) * 10) / 10
+    return round(fee * 10), round(payout * 10)
+
+
+def legacy_loop(pairs):
+    return [legacy_tenths(*row) for row in pairs.itertuples(index=False)]
+
+
+def engine(pairs):
+    return settle_tenths(pairs["Quantity"], pairs["Target"], pairs["Divines"])
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'pairs':>10} {'settle_tenths (ms)':>20} {'legacy loop (ms)':>18}")
+    for n_rows in args.sizes:
+        pairs = make_pairs(n_rows)
+        ours = timed(lambda: engine(pairs), args.repeat)
+        legacy = "-"
+        if n_rows <= LEGACY_MAX_ROWS:
+            legacy = f"{timed(lambda: legacy_loop(pairs), 1) * 1000:.1f}"
+        print(f"{n_rows:>10} {ours * 1000:>20.1f} {legacy:>18}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import pytest
+
+from tests.fake_sheets import FakeSpreadsheet, install
+
+
+@pytest.fixture
+def spreadsheet(monkeypatch):
+    """An empty FakeSpreadsheet that every SheetsStorage opened in the test connects to."""
+    sheets = FakeSpreadsheet()
+    install(sheets, monkeypatch)
+    return sheets
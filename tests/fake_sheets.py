@@ -0,0 +1,245 @@
+"""In-memory stand-in for the parts of gspread that SheetsStorage uses.
+
+FakeSpreadsheet keeps every tab as a list of rows, counts each API request
+by name and can sleep ``latency`` seconds per request to mimic the round
+trip to Google. install() points gspread.authorize and the service account
+loader at it, so bank_storage and the Streamlit app run unchanged, offline:
+
+    sheets = FakeSpreadsheet(latency=0.05)
+    install(sheets)
+
+The tests get one through the ``spreadsheet`` fixture (see conftest.py),
+which patches with pytest's monkeypatch so nothing outlives the test.
+"""
+import itertools
+import re
+import threading
+import time
+from collections import Counter
+
+import gspread
+from gspread.utils import a1_to_rowcol
+
+
+class _ErrorResponse:
+    # Just enough of requests.Response for gspread.exceptions.APIError.
+    def __init__(self, code, message):
+        self.status_code = code
+        self.text = message
+        self._error = {"code": code, "message": message, "status": "FAILED_PRECONDITION"}
+
+    def json(self):
+        return {"error": self._error}
+
+
+def api_error(code, message):
+    return gspread.exceptions.APIError(_ErrorResponse(code, message))
+
+
+def _parse_range(a1):
+    """(first row, first col, last row or None, last col or None) of an A1 range like "A5:D"."""
+    match = re.fullmatch(r"([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?", a1)
+    first_col = a1_to_rowcol(match.group(1) + "1")[1]
+    first_row = int(match.group(2) or 1)
+    if match.group(3) is None:
+        last_row = first_row if match.group(2) else None
+        return first_row, first_col, last_row, first_col
+    last_col = a1_to_rowcol(match.group(3) + "1")[1]
+    return first_row, first_col, int(match.group(4)) if match.group(4) else None, last_col
+
+
+class FakeWorksheet:
+    _ids = itertools.count(1)
+
+    def __init__(self, spreadsheet, title, rows=1000, cols=26):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = next(self._ids)
+        self.row_count = rows
+        self.col_count = cols
+        self.rows = []
+
+    def _request(self, name):
+        self.spreadsheet.request(name)
+
+    def _values(self):
+        # Like the API: cells as strings, trailing empty rows dropped.
+        while self.rows and not any(cell != "" for cell in self.rows[-1]):
+            self.rows.pop()
+        return [[str(cell) for cell in row] for row in self.rows]
+
+    def _range(self, a1=None):
+        values = self._values()
+        if not a1:
+            return values
+        first_row, first_col, last_row, last_col = _parse_range(a1)
+        out = [row[first_col - 1:last_col] for row in values[first_row - 1:last_row]]
+        while out and not any(out[-1]):
+            out.pop()
+        return out
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        while len(cells) < col:
+            cells.append("")
+        cells[col - 1] = value
+
+    def _write(self, a1, values):
+        first_row, first_col = a1_to_rowcol(a1.split("!")[-1].split(":")[0])
+        for i, row in enumerate(values):
+            for j, value in enumerate(row):
+                self._set(first_row + i, first_col + j, value)
+
+    # -- reads --
+    def get(self, range_name=None, **kwargs):
+        self._request("get")
+        return self._range(range_name)
+
+    def get_all_values(self, **kwargs):
+        self._request("get_all_values")
+        values = self._values()
+        width = max((len(row) for row in values), default=0)
+        return [row + [""] * (width - len(row)) for row in values]
+
+    def col_values(self, col, **kwargs):
+        self._request("col_values")
+        out = [row[col - 1] if len(row) >= col else "" for row in self._values()]
+        while out and out[-1] == "":
+            out.pop()
+        return out
+
+    # -- writes --
+    def append_row(self, values, **kwargs):
+        self.append_rows([values])
+
+    def _table_end(self, start_row):
+        # Like values.append: the table is the first run of non-blank rows at or below start_row,
+        # and the new rows go right after it (or at start_row when there is no data there).
+        row = start_row - 1
+        while row < len(self.rows) and not any(cell != "" for cell in self.rows[row]):
+            row += 1
+        if row == len(self.rows):
+            return start_row - 1
+        while row < len(self.rows) and any(cell != "" for cell in self.rows[row]):
+            row += 1
+        return row
+
+    def append_rows(self, values, value_input_option=None, insert_data_option=None, table_range=None, **kwargs):
+        self._request("append_rows")
+        self._values()
+        row = self._table_end(_parse_range(table_range)[0] if table_range else 1)
+        if insert_data_option == "INSERT_ROWS":
+            self.rows[row:row] = [list(values_row) for values_row in values]
+        else:
+            # OVERWRITE (the API default) writes into whatever rows follow the table.
+            for i, values_row in enumerate(values):
+                for j, value in enumerate(values_row):
+                    self._set(row + i + 1, j + 1, value)
+        width = max((len(values_row) for values_row in values), default=1)
+        last_col = gspread.utils.rowcol_to_a1(1, width).rstrip("1")
+        return {"updates": {"updatedRange": f"'{self.title}'!A{row + 1}:{last_col}{row + len(values)}",
+                            "updatedRows": len(values)}}
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self._request("update")
+        self._write(range_name, values)
+
+    def batch_update(self, data, **kwargs):
+        self._request("values_batch_update")
+        for entry in data:
+            self._write(entry["range"], entry["values"])
+
+    def delete_rows(self, start_index, end_index=None):
+        self._request("delete_rows")
+        del self.rows[start_index - 1:end_index or start_index]
+
+    def add_rows(self, rows):
+        self._request("add_rows")
+        self.row_count += rows
+
+    def add_cols(self, cols):
+        self._request("add_cols")
+        self.col_count += cols
+
+
+class FakeSpreadsheet:
+    """The poe_item_bank spreadsheet, in memory; ``calls`` counts API requests by name."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sheets = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def request(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def add_tab(self, title, rows):
+        """Create a tab with ``rows`` directly, without counting a request (for seeding)."""
+        ws = FakeWorksheet(self, title, rows=max(1000, len(rows) + 100))
+        ws.rows = [list(row) for row in rows]
+        self.sheets[title] = ws
+        return ws
+
+    def worksheet(self, title):
+        self.request("worksheet")
+        if title not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def add_worksheet(self, title, rows, cols, **kwargs):
+        self.request("add_worksheet")
+        ws = FakeWorksheet(self, title, rows, cols)
+        self.sheets[title] = ws
+        return ws
+
+    def _tab_and_range(self, a1):
+        title, _, cells = a1.partition("!")
+        title = title.strip("'")
+        if title not in self.sheets:
+            raise api_error(400, f"Unable to parse range: {a1}")
+        return self.sheets[title], cells or None
+
+    def values_batch_get(self, ranges, params=None, **kwargs):
+        self.request("values_batch_get")
+        value_ranges = []
+        for a1 in ranges:
+            ws, cells = self._tab_and_range(a1)
+            value_ranges.append({"range": a1, "values": ws._range(cells)})
+        return {"valueRanges": value_ranges}
+
+    def batch_update(self, body):
+        self.request("batch_update")
+        by_id = {ws.id: ws for ws in self.sheets.values()}
+        for request in body["requests"]:
+            grid = request["deleteDimension"]["range"]
+            del by_id[grid["sheetId"]].rows[grid["startIndex"]:grid["endIndex"]]
+        return {}
+
+
+class _FakeClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open(self, title):
+        self.spreadsheet.request("open")
+        return self.spreadsheet
+
+
+def install(spreadsheet, monkeypatch=None):
+    """Make gspread.authorize() hand out ``spreadsheet`` for any credentials.
+
+    With a pytest ``monkeypatch`` the patches are undone after the test;
+    otherwise they last for the rest of the process.
+    """
+    from google.oauth2 import service_account
+
+    patch = monkeypatch.setattr if monkeypatch is not None else setattr
+    patch(gspread, "authorize", lambda credentials: _FakeClient(spreadsheet))
+    patch(service_account.Credentials, "from_service_account_info", classmethod(
+        lambda cls, info, scopes=None: None))
@@ -0,0 +1,61 @@
+"""Concurrent SheetsStorage.commit_deposits calls against the in-memory Sheets stand-in."""
+import threading
+from collections import Counter
+
+from bank_storage import SheetsStorage
+
+HEADER = ["User", "Item", "Quantity", "ID"]
+DEPOSITS = [
+    {"User": "alice", "Item": "Heavy Belt", "Quantity": 3},
+    {"User": "bob", "Item": "Stellar Amulet", "Quantity": 5},
+]
+
+
+def seed(sheets):
+    sheets.latency = 0.005
+    # The blank row in the middle is read back by col_values but dropped from the ledger.
+    sheets.add_tab("Sheet1", [HEADER, ["carol", "Heavy Belt", "2", "a1"], ["", "", "", ""],
+                              ["dave", "Stellar Amulet", "1", "a2"]])
+    return sheets
+
+
+def ledger_keys(sheets):
+    return Counter((row[0], row[1], int(row[2])) for row in sheets.sheets["Sheet1"].rows[1:] if any(row))
+
+
+def test_commit_with_blank_row(spreadsheet):
+    sheets = seed(spreadsheet)
+    added, duplicates = SheetsStorage({}).commit_deposits(DEPOSITS)
+    assert len(added) == 2 and duplicates == []
+    # The append lands in the gap without writing over the deposit below it.
+    assert ledger_keys(sheets) == Counter({("carol", "Heavy Belt", 2): 1, ("dave", "Stellar Amulet", 1): 1,
+                                           ("alice", "Heavy Belt", 3): 1, ("bob", "Stellar Amulet", 5): 1})
+
+
+def test_concurrent_commits_book_each_deposit_once(spreadsheet):
+    sheets = seed(spreadsheet)
+    start = threading.Barrier(2)
+    results, errors = [], []
+
+    def commit():
+        # Separate storages, like two app processes sharing the spreadsheet.
+        storage = SheetsStorage({})
+        start.wait()
+        try:
+            results.append(storage.commit_deposits(DEPOSITS))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=commit) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    keys = ledger_keys(sheets)
+    for row in DEPOSITS:
+        assert keys[(row["User"], row["Item"], row["Quantity"])] == 1
+    assert sum(keys.values()) == 4
+    added = [record["ID"] for result in results for record in result[0]]
+    assert len(added) == len(DEPOSITS) == len(set(added))
@@ -0,0 +1,71 @@
+"""Confirming the same pending offer twice books it once, on either backend."""
+import threading
+
+import pytest
+
+from bank_storage import SheetsStorage, SQLiteStorage
+
+HEADER = ["User", "Item", "Quantity", "ID"]
+OFFERS = [
+    {"User": "alice", "Item": "Heavy Belt", "Quantity": 3, "ID": "p1"},
+    {"User": "bob", "Item": "Stellar Amulet", "Quantity": 5, "ID": "p2"},
+]
+
+
+def confirm_concurrently(storages):
+    start = threading.Barrier(len(storages))
+    results, errors = [], []
+
+    def confirm(storage):
+        start.wait()
+        try:
+            results.append(storage.confirm_deposits(OFFERS))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=confirm, args=(storage,)) for storage in storages]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    return results
+
+
+def assert_booked_once(results, ids):
+    assert sorted(ids) == ["a1", "p1", "p2"]
+    added = sorted(record["ID"] for result in results for record in result[0])
+    existing = sorted(record["ID"] for result in results for record in result[1])
+    assert added == existing == ["p1", "p2"]
+
+
+@pytest.fixture
+def sheets(spreadsheet):
+    spreadsheet.latency = 0.005
+    spreadsheet.add_tab("Sheet1", [HEADER, ["carol", "Heavy Belt", "2", "a1"]])
+    return spreadsheet
+
+
+def sheet_ids(sheets):
+    return [row[3] for row in sheets.sheets["Sheet1"].rows[1:] if any(row)]
+
+
+def test_sheets_confirm_twice(sheets):
+    storage = SheetsStorage({})
+    first, second = storage.confirm_deposits(OFFERS), storage.confirm_deposits(OFFERS)
+    assert_booked_once([first, second], sheet_ids(sheets))
+    assert second == ([], OFFERS)
+
+
+def test_sheets_concurrent_confirms(sheets):
+    # Separate storages, like two app processes sharing the spreadsheet.
+    results = confirm_concurrently([SheetsStorage({}), SheetsStorage({})])
+    assert_booked_once(results, sheet_ids(sheets))
+
+
+def test_sqlite_concurrent_confirms(tmp_path):
+    path = str(tmp_path / "bank.sqlite3")
+    local = SQLiteStorage(path)
+    local.append_deposits([{"User": "carol", "Item": "Heavy Belt", "Quantity": 2, "ID": "a1"}])
+    results = confirm_concurrently([local, SQLiteStorage(path)])
+    assert_booked_once(results, local.load_ledger().frame["ID"].tolist())
@@ -0,0 +1,29 @@
+"""SheetsStorage.fetch_tabs falling back to per-tab reads."""
+import gspread
+import pytest
+
+from bank_storage import SheetsStorage
+from tests.fake_sheets import api_error
+
+
+def test_missing_tab_is_created_and_read(spreadsheet):
+    spreadsheet.add_tab("Sheet1", [["User", "Item", "Quantity", "ID"], ["alice", "Heavy Belt", "3", "a1"]])
+    frames = SheetsStorage({}).fetch_tabs(["Sheet1", "Targets"])
+    assert "Targets" in spreadsheet.sheets
+    assert frames["Sheet1"].frame["ID"].tolist() == ["a1"]
+
+
+def test_quota_error_is_not_retried_per_tab(spreadsheet, monkeypatch):
+    spreadsheet.add_tab("Sheet1", [["User", "Item", "Quantity", "ID"]])
+    storage = SheetsStorage({})
+    storage.get_spreadsheet()
+
+    def exhausted(*args, **kwargs):
+        spreadsheet.request("values_batch_get")
+        raise api_error(429, "Quota exceeded")
+    monkeypatch.setattr(spreadsheet, "values_batch_get", exhausted)
+    monkeypatch.setattr("bank_quota.SHEETS_RETRY_ATTEMPTS", 1)
+    spreadsheet.calls.clear()
+    with pytest.raises(gspread.exceptions.APIError):
+        storage.fetch_tabs(["Sheet1", "Targets"])
+    assert dict(spreadsheet.calls) == {"values_batch_get": 1}
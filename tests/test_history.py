@@ -0,0 +1,80 @@
+"""HistoryRecorder snapshots against a storage stub whose history writes can fail."""
+import threading
+
+import pandas as pd
+import pytest
+
+from bank_history import HISTORY_COLUMNS, HISTORY_RETRY_SECONDS, HISTORY_SNAPSHOT_SECONDS, HistoryRecorder
+
+START = pd.Timestamp("2024-01-01 00:00:00")
+TOTALS = pd.Series({"Heavy Belt": 3})
+VALUES = pd.Series({"Heavy Belt": 20})
+
+
+class HistoryStore:
+    def __init__(self):
+        self.rows = []
+        self.appends = 0
+        self.failing = False
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def load_history_frame(self):
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+    def append_history(self, rows):
+        self.appends += 1
+        self.entered.set()
+        self.release.wait(5)
+        if self.failing:
+            raise OSError("Sheets is down")
+        self.rows += rows
+
+    def replace_history(self, rows):
+        self.rows = list(rows)
+
+
+def at(seconds):
+    return START + pd.Timedelta(seconds=seconds)
+
+
+def test_failed_snapshot_backs_off():
+    store = HistoryStore()
+    store.failing = True
+    recorder = HistoryRecorder(store)
+    with pytest.raises(OSError):
+        recorder.maybe_snapshot(TOTALS, VALUES, now=at(0))
+    # Page runs before the retry time don't touch storage again.
+    recorder.maybe_snapshot(TOTALS, VALUES, now=at(HISTORY_RETRY_SECONDS - 1))
+    assert store.appends == 1
+    with pytest.raises(OSError):
+        recorder.maybe_snapshot(TOTALS, VALUES, now=at(HISTORY_RETRY_SECONDS))
+    # The second failure waits twice as long.
+    recorder.maybe_snapshot(TOTALS, VALUES, now=at(3 * HISTORY_RETRY_SECONDS - 1))
+    assert store.appends == 2
+    assert recorder.history().levels == {}
+
+    store.failing = False
+    recorder.maybe_snapshot(TOTALS, VALUES, now=at(3 * HISTORY_RETRY_SECONDS))
+    assert recorder.history().levels == {"Heavy Belt": (3, 20)}
+    assert [row[1:] for row in store.rows] == [["Heavy Belt", 3, 20]]
+    # Back on the normal schedule once a write went through.
+    recorder.maybe_snapshot(TOTALS.add(1), VALUES, now=at(3 * HISTORY_RETRY_SECONDS + HISTORY_SNAPSHOT_SECONDS))
+    assert store.appends == 4
+
+
+def test_concurrent_snapshot_is_skipped():
+    store = HistoryStore()
+    store.release.clear()
+    recorder = HistoryRecorder(store)
+    writer = threading.Thread(target=recorder.maybe_snapshot, args=(TOTALS, VALUES), kwargs={"now": at(0)})
+    writer.start()
+    assert store.entered.wait(5)
+    # Another page run while the write is in flight returns straight away instead of queueing behind it.
+    recorder.maybe_snapshot(TOTALS, VALUES, now=at(0))
+    assert recorder.history().levels == {}
+    store.release.set()
+    writer.join()
+    assert store.appends == 1
+    assert recorder.history().levels == {"Heavy Belt": (3, 20)}
@@ -0,0 +1,75 @@
+"""MirroredStorage: the SQLite outbox and its replay onto Sheets."""
+import sqlite3
+
+import pytest
+
+import bank_storage
+from bank_storage import SheetsStorage, SQLiteStorage, open_storage
+from tests.fake_sheets import api_error
+
+DEPOSITS = [
+    {"User": "alice", "Item": "Heavy Belt", "Quantity": 3},
+    {"User": "bob", "Item": "Stellar Amulet", "Quantity": 5},
+]
+
+
+@pytest.fixture
+def store_path(spreadsheet, tmp_path, monkeypatch):
+    monkeypatch.setattr(bank_storage, "MIRROR_BATCH_SECONDS", 0.01)
+    spreadsheet.add_tab("Sheet1", [["User", "Item", "Quantity", "ID"]])
+    return str(tmp_path / "bank.sqlite3")
+
+
+def ledger_ids(spreadsheet):
+    return [row[3] for row in spreadsheet.sheets["Sheet1"].rows[1:]]
+
+
+def test_unmirrored_changes_are_replayed_after_a_restart(spreadsheet, store_path):
+    local = SQLiteStorage(store_path)
+    local.hydrate_from(SheetsStorage({}))
+    local.outbox = True
+    added = local.append_deposits(DEPOSITS)
+    local.delete_deposits([added[0]["ID"]])
+    # The process stops here, before any mirror sent these.
+    assert local.outbox_pending() == 2
+
+    storage = open_storage({}, backend="sqlite", sqlite_path=store_path)
+    assert storage.mirror.pending() == 0
+    assert ledger_ids(spreadsheet) == [added[1]["ID"]]
+
+
+def test_failed_write_is_set_aside(spreadsheet, store_path, monkeypatch):
+    storage = open_storage({}, backend="sqlite", sqlite_path=store_path)
+
+    def rejected(rows):
+        raise api_error(400, "bad")
+    monkeypatch.setattr(storage.sheets, "append_admin_logs", rejected)
+    storage.append_admin_logs([["2024-01-01 00:00:00", "admin", "Test", ""]])
+    added = storage.append_deposits(DEPOSITS)
+    assert storage.mirror.flush(10)
+
+    assert ledger_ids(spreadsheet) == [r["ID"] for r in added]
+    [(op, rows, error)] = storage.mirror.failures()
+    assert op == "append_admin_logs" and len(rows) == 1 and "bad" in error
+
+
+def test_pending_ids_come_from_sheets_after_migration(spreadsheet, store_path):
+    # A database from before pending duplicates carried an ID, next to a tab without them either.
+    conn = sqlite3.connect(store_path)
+    conn.executescript("""
+        CREATE TABLE pending_dupes (seq INTEGER PRIMARY KEY AUTOINCREMENT, user TEXT, item TEXT, quantity INTEGER);
+        INSERT INTO pending_dupes (user, item, quantity) VALUES ('alice', 'Heavy Belt', 3);
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        INSERT INTO meta VALUES ('hydrated', 1);
+    """)
+    conn.close()
+    spreadsheet.add_tab("PendingDupes", [["User", "Item", "Quantity"], ["alice", "Heavy Belt", "3"]])
+
+    storage = open_storage({}, backend="sqlite", sqlite_path=store_path)
+    [tab_id] = [row[3] for row in spreadsheet.sheets["PendingDupes"].rows[1:]]
+    assert storage.load_pending_dupes_frame()["ID"].tolist() == [tab_id]
+    assert not storage.local.pending_ids_stale()
+    # Declining it now reaches the tab too.
+    storage.remove_pending_dupes([tab_id])
+    assert storage.mirror.flush(10)
+    assert spreadsheet.sheets["PendingDupes"].rows[1:] == []
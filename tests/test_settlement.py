@@ -0,0 +1,66 @@
+"""settle_tenths/settle_bank against an exact Fraction reference."""
+import math
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bank_core import PAYOUT_FEE_PCT, settle_bank, settle_tenths
+
+
+def exact_tenths(qty, target, divine_val):
+    """(fee, payout) in whole tenths of a Divine, floored, computed with exact fractions."""
+    if not target:
+        return 0, 0
+    raw = Fraction(int(qty), int(target)) * Fraction(round(divine_val * 100), 100)
+    fee = raw * Fraction(PAYOUT_FEE_PCT, 100)
+    return math.floor(fee * 10), math.floor((raw - fee) * 10)
+
+
+def float_tenths(qty, target, divine_val):
+    # The per-user float math the app used before settle_tenths.
+    raw_payout = (qty / target) * divine_val if target else 0
+    return math.floor(raw_payout * 0.10 * 10), math.floor((raw_payout - raw_payout * 0.10) * 10)
+
+
+def test_matches_exact_reference():
+    rng = np.random.default_rng(42)
+    n_rows = 20_000
+    pairs = pd.DataFrame({
+        "Quantity": rng.integers(1, 5000, n_rows),
+        "Target": rng.choice([0, 1, 3, 7, 30, 99, 100, 333, 1000], n_rows),
+        "Divines": rng.integers(0, 50_000, n_rows) / 100,
+    })
+    fee, payout = settle_tenths(pairs["Quantity"], pairs["Target"], pairs["Divines"])
+    expected = [exact_tenths(*row) for row in pairs.itertuples(index=False)]
+    assert list(zip(fee.tolist(), payout.tolist())) == expected
+
+
+@pytest.mark.parametrize("qty, target, divine_val", [
+    (2, 3, 2.5), (13, 3, 1.0), (10, 3, 1.9), (1000, 3, 206.77), (4100, 7, 68.32), (4168, 3, 472.0),
+])
+def test_boundary_cases_the_float_floor_got_wrong(qty, target, divine_val):
+    expected = exact_tenths(qty, target, divine_val)
+    assert float_tenths(qty, target, divine_val) != expected
+    fee, payout = settle_tenths(pd.Series([qty]), pd.Series([target]), pd.Series([divine_val]))
+    assert (fee[0], payout[0]) == expected
+
+
+def test_settlement_reconciles():
+    rng = np.random.default_rng(1)
+    n_users, n_items = 2000, 20
+    items = [f"Item {i}" for i in range(n_items)]
+    totals = pd.DataFrame({
+        "Item": np.repeat(items, n_users),
+        "User": [f"user{u}" for u in range(n_users)] * n_items,
+        "Quantity": rng.integers(0, 40, n_items * n_users),
+    })
+    targets = {item: int(rng.integers(1, 2000)) for item in items}
+    divines = {item: int(rng.integers(0, 100_000)) / 100 for item in items}
+    _, settlement = settle_bank(totals, items, targets, divines, completed_only=False)
+    assert (settlement["Value"] == settlement["Fees"] + settlement["Payouts"] + settlement["Dust"]).all()
+    assert (settlement["Dust"] >= 0).all()
+    for item, row in settlement.iterrows():
+        exact_value = Fraction(int(row["Total"]), targets[item]) * Fraction(round(divines[item] * 100), 100)
+        assert row["Value"] == math.floor(exact_value * 10), item
@@ -0,0 +1,22 @@
+"""SQLiteStorage deposit writes."""
+import pytest
+
+from bank_storage import SQLiteStorage
+
+
+@pytest.fixture
+def local(tmp_path):
+    return SQLiteStorage(str(tmp_path / "bank.sqlite3"))
+
+
+def test_commit_uses_the_shared_duplicate_rule(local):
+    local.append_deposits([{"User": "Alice", "Item": "Heavy Belt", "Quantity": 3}])
+    added, duplicates = local.commit_deposits([
+        {"User": " alice ", "Item": "Heavy Belt", "Quantity": 3},     # same deposit, user spelled differently
+        {"User": "bob", "Item": "Heavy Belt", "Quantity": 3},
+        {"User": "Bob", "Item": "Heavy Belt", "Quantity": 3},         # repeats the line above
+        {"User": "bob", "Item": "Stellar Amulet", "Quantity": 3},
+    ])
+    assert [(r["User"], r["Item"]) for r in added] == [("bob", "Heavy Belt"), ("bob", "Stellar Amulet")]
+    assert [r["User"] for r in duplicates] == [" alice ", "Bob"]
+    assert len(local.load_ledger().frame) == 3